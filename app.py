@@ -14,22 +14,460 @@
 #       IMPORT LIBRARIES
 # ------------------------------
 
-import requests
-import pandas as pd
-import regex as re
+import argparse
+import codecs
+import concurrent.futures
+import gzip
+import hashlib
+import heapq
+import importlib
+import math
+import mmap
+import queue
+import random
+import socket
+import sqlite3
+import struct
 import json
 import time
+import warnings
 import sys
+import os
 import logging
-
-from datetime import datetime, timedelta
+import threading
+import weakref
+
+from array import array
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
 from pathlib import Path
+from urllib.parse import urlparse
 from zoneinfo import ZoneInfo
-from PIL import Image, ImageFont, ImageDraw 
+
+
+class _LazyModule:
+    """
+    Placeholder for a heavy dependency, imported on first attribute access.
+    The import then replaces the placeholder in this module's globals, so
+    runs that exit early (lock file, incomplete data) never load pandas,
+    numpy or Pillow.
+    """
+
+    def __init__(self, module, alias):
+        self._module = module
+        self._alias = alias
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._module)
+        globals()[self._alias] = module
+        return getattr(module, attr)
+
+
+requests = _LazyModule("requests", "requests")
+np = _LazyModule("numpy", "np")
+pd = _LazyModule("pandas", "pd")
+re = _LazyModule("regex", "re")
+Image = _LazyModule("PIL.Image", "Image")
+ImageFont = _LazyModule("PIL.ImageFont", "ImageFont")
+ImageDraw = _LazyModule("PIL.ImageDraw", "ImageDraw")
+PngImagePlugin = _LazyModule("PIL.PngImagePlugin", "PngImagePlugin")
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
+# ------------------------------
+#          RUN METRICS
+# ------------------------------
+
+# Timing spans and counters for one run. main() writes them to
+# RUN_REPORT_FILE next to the PNGs and, if asked, in Prometheus text format.
+RUN_REPORT_FILE = "run_report.json"
+# RUN_METRICS_PROMETHEUS=<file> also exports the metrics for a node_exporter textfile collector
+RUN_METRICS_PROMETHEUS = os.environ.get("RUN_METRICS_PROMETHEUS")
+
+
+class RunMetrics:
+    """
+    Nested timing spans ("fetch/ipma/aggregate"), labelled counters and histograms.
+    Safe to use from the station lookup threads; work done in process pool
+    workers is recorded by the parent from what the tasks return.
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now(ZoneInfo("UTC"))
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.spans = []
+        self.counters = {}
+        self.histograms = {}
+        self.info = {}
+
+    @contextmanager
+    def span(self, name):
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(name)
+        path = "/".join(stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stack.pop()
+            self._add(path, time.perf_counter() - start, start - self._t0)
+
+    def current(self):
+        """The calling thread's open span names, for handing to another thread."""
+        return list(self._local.__dict__.get("stack", []))
+
+    def inherit(self, stack):
+        """Nest the calling thread's spans under another thread's current() spans."""
+        self._local.stack = list(stack)
+
+    def record(self, name, seconds):
+        """Add a span timed elsewhere (e.g. in a worker process) under the current span."""
+        self._add("/".join(self._local.__dict__.get("stack", []) + [name]), seconds)
+
+    def _add(self, path, seconds, offset=None):
+        with self._lock:
+            self.spans.append({"name": path, "offset": None if offset is None else round(offset, 6), "seconds": round(seconds, 6)})
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets, **labels):
+        """Add value to a histogram with the given upper bucket bounds (ascending)."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.setdefault(key, {"buckets": list(buckets), "counts": [0] * len(buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+                    break
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def report(self):
+        return {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "seconds": round(time.perf_counter() - self._t0, 6),
+            **self.info,
+            "spans": list(self.spans),
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in sorted(self.counters.items())],
+            "histograms": [{"name": name, "labels": dict(labels), **histogram}
+                           for (name, labels), histogram in sorted(self.histograms.items())],
+        }
+
+    def write_json(self, path):
+        Path(path).write_text(json.dumps(self.report(), ensure_ascii=False, indent=1), encoding="utf-8")
+
+    def to_prometheus(self, prefix="daily_weather_report"):
+        """Counters as <prefix>_<name>_total, histograms, span durations summed per span name."""
+        def escape(value):
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        def labels_text(labels):
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+        lines = []
+        by_name = {}
+        for (name, labels), value in sorted(self.counters.items()):
+            by_name.setdefault(name, []).append((labels, value))
+        for name, samples in by_name.items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.extend(f"{prefix}_{name}_total{labels_text(labels)} {value}" for labels, value in samples)
+
+        by_name = {}
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            by_name.setdefault(name, []).append((labels, histogram))
+        for name, samples in by_name.items():
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for labels, histogram in samples:
+                cumulative = 0
+                # Counts are per bucket; Prometheus buckets are cumulative and end with +Inf
+                for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                    cumulative += count
+                    lines.append(f"{prefix}_{name}_bucket{labels_text(labels + (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{prefix}_{name}_bucket{labels_text(labels + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{prefix}_{name}_sum{labels_text(labels)} {histogram['sum']:.6f}")
+                lines.append(f"{prefix}_{name}_count{labels_text(labels)} {histogram['count']}")
+
+        span_seconds = {}
+        for span in self.spans:
+            span_seconds[span["name"]] = span_seconds.get(span["name"], 0.0) + span["seconds"]
+        lines.append(f"# TYPE {prefix}_span_seconds gauge")
+        lines.extend(f"{prefix}_span_seconds{labels_text([('span', name)])} {seconds:.6f}" for name, seconds in span_seconds.items())
+        lines.append(f"# TYPE {prefix}_run_timestamp_seconds gauge")
+        lines.append(f"{prefix}_run_timestamp_seconds {self.started_at.timestamp():.0f}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        tmp = Path(f"{path}.tmp")
+        tmp.write_text(self.to_prometheus(), encoding="utf-8")
+        tmp.replace(path)
+
+
+METRICS = RunMetrics()
+
+
+def _count_bytes(chunks, source):
+    """Pass byte chunks through, adding their size to the bytes_in counter."""
+    total = 0
+    try:
+        for chunk in chunks:
+            total += len(chunk)
+            yield chunk
+    finally:
+        METRICS.count("bytes_in", total, source=source)
+
+# ------------------------------
+#          HTTP CLIENT
+# ------------------------------
+
+# Every request goes through HTTP: one keep-alive session (a connection pool
+# per host), a token-bucket request budget and concurrency cap per host, the
+# same timeouts and retry policy everywhere, and per-host latency histograms.
+HTTP_USER_AGENT = "VostPTExtremosMeteo/1.0 (DailyWeatherReport; +https://github.com)"
+
+# (requests per second, burst, concurrent requests, (connect, read) timeout)
+HostPolicy = namedtuple("HostPolicy", ["rate", "burst", "concurrency", "timeout"])
+HTTP_HOST_POLICIES = {
+    # Station lookups; STATION_LOOKUP_PER_HOST caps how many run at once
+    "api.fogos.pt": HostPolicy(4.0, 8, int(os.environ.get("STATION_LOOKUP_PER_HOST", "4")), (5, 30)),
+    # Every request counts toward bot.fogos.pt's rate limit
+    "bot.fogos.pt": HostPolicy(0.2, 1, 1, (5, 30)),
+    "api.ipma.pt": HostPolicy(1.0, 2, 2, (5, 60)),
+}
+HTTP_DEFAULT_POLICY = HostPolicy(4.0, 8, 4, (5, 60))
+
+# Connection errors, timeouts, 429 and 5xx are retried up to HTTP_RETRIES
+# more times with full-jitter exponential backoff, honouring Retry-After
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "2"))
+HTTP_BACKOFF_BASE = 2.0  # seconds, doubled on every retry
+HTTP_BACKOFF_CAP = 30.0
+# A Retry-After longer than this returns the response instead of waiting
+HTTP_MAX_RETRY_AFTER = 120.0
+# Upper bounds (seconds) of the http_request_seconds histogram buckets
+HTTP_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class FetchCancelled(Exception):
+    """Raised inside a request or download whose result is no longer wanted."""
+
+
+def _retry_after(response):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None."""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(ZoneInfo("UTC"))).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff_delay(attempt, retry_after=None, base=HTTP_BACKOFF_BASE, cap=HTTP_BACKOFF_CAP):
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    return max(delay, retry_after) if retry_after is not None else delay
+
+
+def _wait(seconds, cancel=None):
+    """Sleep, or raise FetchCancelled as soon as cancel is set."""
+    if cancel is None:
+        time.sleep(seconds)
+    elif cancel.wait(seconds):
+        raise FetchCancelled("request cancelled")
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average and up to `burst` at once."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, cancel=None):
+        """Take one token, waiting for it if the budget is spent. Returns the seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            _wait(delay, cancel)
+            waited += delay
+
+
+class HttpClient:
+    """
+    Shared, thread-safe GET client. Hosts without an entry in policies use
+    default_policy. The session is only created on the first request.
+    """
+
+    def __init__(self, policies=HTTP_HOST_POLICIES, default_policy=HTTP_DEFAULT_POLICY, retries=HTTP_RETRIES):
+        self.policies = policies
+        self.default_policy = default_policy
+        self.retries = retries
+        self._hosts = {}
+        self._session = None
+        self._lock = threading.Lock()
+        # Connections that sent a request under a cancel event, for abort()
+        self._connections = weakref.WeakSet()
+        self._scope = threading.local()
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                session.headers["User-Agent"] = HTTP_USER_AGENT
+                # requests keeps one pool per host; size each for the largest concurrency cap
+                pool_size = max(policy.concurrency for policy in (self.default_policy, *self.policies.values()))
+                adapter = self._adapter(pool_connections=8, pool_maxsize=pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+            return self._session
+
+    def _adapter(self, **kwargs):
+        """
+        An HTTPAdapter whose connections remember the cancel event of the
+        request they are sending, so abort() can find and interrupt them.
+        """
+        import urllib3
+
+        client = self
+
+        class Abortable:
+            def request(self, *args, **kwargs):
+                self.cancel = getattr(client._scope, "cancel", None)
+                if self.cancel is not None:
+                    with client._lock:
+                        client._connections.add(self)
+                result = super().request(*args, **kwargs)
+                # abort() may have run while the socket was still being opened
+                if self.cancel is not None and self.cancel.is_set():
+                    self.abort()
+                return result
+
+            def abort(self):
+                sock = self.sock
+                if sock is not None:
+                    try:
+                        # The plain socket's shutdown, also under TLS: it wakes a
+                        # blocked read and leaves closing to the owning thread.
+                        socket.socket.shutdown(sock, socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+        class Connection(Abortable, urllib3.connection.HTTPConnection):
+            pass
+
+        class TLSConnection(Abortable, urllib3.connection.HTTPSConnection):
+            pass
+
+        class Pool(urllib3.HTTPConnectionPool):
+            ConnectionCls = Connection
+
+        class TLSPool(urllib3.HTTPSConnectionPool):
+            ConnectionCls = TLSConnection
+
+        class Adapter(requests.adapters.HTTPAdapter):
+            def init_poolmanager(self, *args, **kwargs):
+                super().init_poolmanager(*args, **kwargs)
+                self.poolmanager.pool_classes_by_scheme = {"http": Pool, "https": TLSPool}
+
+        return Adapter(**kwargs)
+
+    def abort(self, cancel):
+        """
+        Set cancel and shut down the sockets of requests sent under it, so a
+        caller blocked on a slow host fails at once instead of at its timeout.
+        """
+        cancel.set()
+        with self._lock:
+            connections = [connection for connection in self._connections if connection.cancel is cancel]
+        for connection in connections:
+            connection.abort()
+
+    def _host(self, host):
+        """(policy, token bucket, concurrency semaphore) for host."""
+        with self._lock:
+            if host not in self._hosts:
+                policy = self.policies.get(host.split(":")[0], self.default_policy)
+                self._hosts[host] = (policy, TokenBucket(policy.rate, policy.burst), threading.BoundedSemaphore(policy.concurrency))
+            return self._hosts[host]
+
+    def get(self, url, headers=None, timeout=None, stream=False, cancel=None):
+        """
+        requests.get() within the host's budget, retrying transient failures.
+        When retries run out on a 429/5xx that response is returned, so
+        callers handle status codes as before. Setting cancel stops waiting
+        for a token or a backoff with FetchCancelled; abort(cancel) also
+        interrupts the request (or streamed body) in flight.
+        """
+        host = urlparse(url).netloc
+        policy, bucket, slots = self._host(host)
+        for attempt in range(self.retries + 1):
+            if cancel is not None and cancel.is_set():
+                raise FetchCancelled("request cancelled")
+            if bucket.acquire(cancel):
+                METRICS.count("http_throttled", host=host)
+            METRICS.count("http_requests", host=host)
+            start = time.perf_counter()
+            try:
+                with slots:
+                    self._scope.cancel = cancel
+                    try:
+                        response = self.session.get(url, headers=headers, timeout=timeout or policy.timeout, stream=stream)
+                    finally:
+                        self._scope.cancel = None
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if cancel is not None and cancel.is_set():
+                    raise FetchCancelled("request cancelled") from e
+                METRICS.observe("http_request_seconds", time.perf_counter() - start, HTTP_LATENCY_BUCKETS, host=host)
+                METRICS.count("http_errors", host=host)
+                if attempt == self.retries:
+                    raise
+                reason, retry_after = e, None
+            else:
+                METRICS.observe("http_request_seconds", time.perf_counter() - start, HTTP_LATENCY_BUCKETS, host=host)
+                if response.status_code != 429 and response.status_code < 500:
+                    return response
+                retry_after = _retry_after(response)
+                if attempt == self.retries or (retry_after is not None and retry_after > HTTP_MAX_RETRY_AFTER):
+                    return response
+                response.close()
+                reason = f"HTTP {response.status_code}"
+
+            delay = _backoff_delay(attempt, retry_after)
+            logger.warning(f"{host}: {reason}; retrying in {delay:.1f}s")
+            METRICS.count("http_retries", host=host)
+            _wait(delay, cancel)
+
+
+HTTP = HttpClient()
+
+
 # ---------------------------------------
 #    GET DATA AND GENERATE DATAFRAMES
 # ----------------------------------------
@@ -37,287 +475,1274 @@ logger = logging.getLogger(__name__)
 # Define URL 
 
 #url = 'https://www.ipma.pt/pt/otempo/obs.superficie/table-top-stations-all.jsp'
-URL_BOT_FOGOS = 'https://bot.fogos.pt/ipma.php'
-URL_IPMA_API = 'https://api.ipma.pt/open-data/observation/meteorology/stations/observations.json'
+# Each can be overridden from the environment, e.g. to point at benchmarks/http_standin.py
+URL_BOT_FOGOS = os.environ.get("URL_BOT_FOGOS", 'https://bot.fogos.pt/ipma.php')
+URL_IPMA_API = os.environ.get("URL_IPMA_API", 'https://api.ipma.pt/open-data/observation/meteorology/stations/observations.json')
+URL_FOGOS_STATIONS_V2 = os.environ.get("URL_FOGOS_STATIONS_V2", 'https://api.fogos.pt/v2/weather/stations')
+URL_FOGOS_STATIONS_V1 = os.environ.get("URL_FOGOS_STATIONS_V1", 'https://api.fogos.pt/v1/weather/stations')
 
 # Headers to reduce Cloudflare bot blocking
 HEADERS = {
-    "User-Agent": "VostPTExtremosMeteo/1.0 (DailyWeatherReport; +https://github.com)",
+    "User-Agent": HTTP_USER_AGENT,
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
 }
 
-def _is_valid(value):
-    """Exclude -99.0 (IPMA's invalid/missing indicator)."""
-    return value is not None and value != -99.0
+# IPMA's observation hour keys ("2026-02-14T01:00") are in UTC. The report day
+# is the calendar day in REPORT_TIMEZONE, which defaults to the feed's own clock.
+IPMA_FEED_TIMEZONE = ZoneInfo("UTC")
+REPORT_TIMEZONE = os.environ.get("REPORT_TIMEZONE", "UTC")
+
+# WRITE_CHECK_CSV=1 dumps the report day's station table to check.csv for debugging
+WRITE_CHECK_CSV = os.environ.get("WRITE_CHECK_CSV", "0") == "1"
 
 
-def fetch_from_ipma_api(yesterday_date):
+def report_day_hours(report_date, tz_name=REPORT_TIMEZONE):
     """
-    Fetch from official IPMA API (no Cloudflare) and aggregate hourly → daily.
-    Returns json_data in same format as bot.fogos.pt: {date: {stationId: {temp_max, ...}}}
+    Return the feed hour keys that fall on report_date (YYYY-MM-DD) in tz_name,
+    in chronological order. That is 24 keys, or 23/25 on DST change days.
     """
-    logger.info(f"Fetching from IPMA API (fallback): {URL_IPMA_API}")
-    r = requests.get(URL_IPMA_API, headers=HEADERS, timeout=60)
-    r.raise_for_status()
-    hourly = r.json()
-    hourly_keys = sorted(hourly.keys())
+    start = datetime.strptime(report_date, "%Y-%m-%d").replace(tzinfo=ZoneInfo(tz_name))
+    end = (start + timedelta(days=1)).astimezone(IPMA_FEED_TIMEZONE)
+    hour = start.astimezone(IPMA_FEED_TIMEZONE)
+    hours = []
+    while hour < end:
+        hours.append(hour.strftime("%Y-%m-%dT%H:%M"))
+        hour += timedelta(hours=1)
+    return hours
 
-    # Aggregate by date (YYYY-MM-DD) and station
-    # IPMA: temperatura, humidade, intensidadeVentoKM, precAcumulada
-    daily_by_date_station = {}  # {(date, stationId): {temps, hums, winds, precs}}
 
+# IPMA_STREAMING=0 falls back to parsing the whole observations.json at once
+IPMA_STREAMING = os.environ.get("IPMA_STREAMING", "1") == "1"
+IPMA_STREAM_CHUNK_SIZE = 64 * 1024
+
+_JSON_WHITESPACE = " \t\n\r"
+
+
+def _iter_hourly_records(chunks, hourly_keys=None):
+    """
+    Incrementally parse IPMA's {hour: {stationId: obs}} document from an
+    iterable of text chunks, yielding (hour, stationId, obs) as soon as each
+    station record is complete. Only the unparsed tail of the current chunk
+    and the record being decoded are held in memory. Every hour key seen is
+    appended to hourly_keys, if given.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf, pos = "", 0
+    state, hour, station_id = "start", None, None
+
+    while state != "done":
+        while pos < len(buf) and buf[pos] in _JSON_WHITESPACE:
+            pos += 1
+        try:
+            if pos >= len(buf):
+                raise IndexError
+            c = buf[pos]
+            if state == "start":
+                if c != "{":
+                    raise ValueError(f"Expected '{{' at start of observations, got {c!r}")
+                pos, state = pos + 1, "hour_key"
+            elif state in ("hour_key", "station_key"):
+                if c == "}":
+                    pos, state = pos + 1, "done" if state == "hour_key" else "hour_sep"
+                elif c == '"':
+                    key, pos = json.decoder.scanstring(buf, pos + 1)
+                    if state == "hour_key":
+                        hour, state = key, "hour_colon"
+                        if hourly_keys is not None:
+                            hourly_keys.append(hour)
+                    else:
+                        station_id, state = key, "station_colon"
+                else:
+                    raise ValueError(f"Unexpected {c!r} in observations at offset {pos}")
+            elif state in ("hour_colon", "station_colon"):
+                if c != ":":
+                    raise ValueError(f"Expected ':' in observations at offset {pos}, got {c!r}")
+                pos, state = pos + 1, "hour_value" if state == "hour_colon" else "station_value"
+            elif state == "hour_value" and c == "{":
+                pos, state = pos + 1, "station_key"
+            elif state in ("hour_value", "station_value"):
+                value, end = decoder.raw_decode(buf, pos)
+                # A value ending exactly at the buffer edge may be a truncated number
+                if end >= len(buf):
+                    raise IndexError
+                pos = end
+                if state == "station_value":
+                    yield hour, station_id, value
+                    state = "station_sep"
+                else:
+                    state = "hour_sep"  # not a dict of stations, skip it
+            elif state in ("hour_sep", "station_sep"):
+                if c == ",":
+                    pos, state = pos + 1, "hour_key" if state == "hour_sep" else "station_key"
+                elif c == "}":
+                    pos, state = pos + 1, "done" if state == "hour_sep" else "hour_sep"
+                else:
+                    raise ValueError(f"Expected ',' or '}}' in observations at offset {pos}, got {c!r}")
+        except (IndexError, json.JSONDecodeError):
+            # Incomplete token at the end of the buffer: read more and retry
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError("Truncated observations document")
+            buf, pos = buf[pos:] + chunk, 0
+
+
+def _iter_records_from_dict(hourly, hourly_keys=None):
+    """Same records as _iter_hourly_records, from an already parsed document."""
     for dt_str, stations in hourly.items():
+        if hourly_keys is not None:
+            hourly_keys.append(dt_str)
         if not isinstance(stations, dict):
             continue
-        date_part = dt_str[:10]  # "2026-02-14T01:00" -> "2026-02-14"
         for station_id, obs in stations.items():
-            if obs is None:
+            yield dt_str, station_id, obs
+
+
+def _iter_text_chunks(byte_chunks, encoding=None):
+    """Decode a streamed response body into text chunks without buffering it all."""
+    decoder = codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+    for chunk in byte_chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+# Hourly variables kept in the observation cube, in axis order
+CUBE_VARIABLES = ("temperatura", "humidade", "intensidadeVentoKM", "precAcumulada")
+TEMP, HUM, WIND, PREC = range(len(CUBE_VARIABLES))
+
+
+class ObservationCube:
+    """
+    Dense stations × hours × variables float32 array of hourly observations.
+    Records are appended into flat columns with add() and laid out in one go
+    by build(); IPMA's -99.0 sentinel (and negative precipitation) become NaN
+    so daily extremes are a single NaN-aware reduction over the hour axis.
+    """
+
+    def __init__(self):
+        self.station_index = {}  # {stationId: row}
+        self.hour_index = {}  # {"YYYY-MM-DDTHH:MM": column}, sorted after build()
+        self.values = None
+        self._station_pos = array("l")
+        self._hour_pos = array("l")
+        self._columns = array("f")
+
+    def add(self, hour, station_id, obs):
+        """Append one hourly station observation."""
+        if obs is None:
+            return
+        station_id = str(station_id)
+        if station_id not in self.station_index:
+            self.station_index[station_id] = len(self.station_index)
+        if hour not in self.hour_index:
+            self.hour_index[hour] = len(self.hour_index)
+        self._station_pos.append(self.station_index[station_id])
+        self._hour_pos.append(self.hour_index[hour])
+        for name in CUBE_VARIABLES:
+            value = obs.get(name)
+            self._columns.append(np.nan if value is None else value)
+
+    def build(self):
+        """Scatter the appended records into the cube, with hours in chronological order."""
+        hours = sorted(self.hour_index)
+        remap = np.empty(len(hours), dtype=np.intp)
+        for new, hour in enumerate(hours):
+            remap[self.hour_index[hour]] = new
+        self.hour_index = {hour: i for i, hour in enumerate(hours)}
+
+        self.values = np.full((len(self.station_index), len(hours), len(CUBE_VARIABLES)), np.nan, dtype=np.float32)
+        if self._columns:
+            rows = np.frombuffer(self._station_pos, dtype="l")
+            cols = remap[np.frombuffer(self._hour_pos, dtype="l")]
+            self.values[rows, cols] = np.frombuffer(self._columns, dtype="f").reshape(-1, len(CUBE_VARIABLES))
+        self._station_pos, self._hour_pos, self._columns = array("l"), array("l"), array("f")
+
+        for var in (TEMP, HUM, WIND):
+            self.values[:, :, var][self.values[:, :, var] == -99.0] = np.nan
+        self.values[:, :, PREC][self.values[:, :, PREC] < 0] = np.nan  # prec can be 0
+        return self.values
+
+    def daily_aggregates(self, day_of=None):
+        """
+        Reduce the cube to daily values per station, in bot.fogos.pt format:
+        {date: {stationId: {temp_max, temp_min, ...}}}. Station-days without
+        any valid temperature are left out. day_of maps each hour key to the
+        date it counts towards; by default that is the key's own date.
+        """
+        if self.values is None:
+            self.build()
+        hours = list(self.hour_index)
+        if not hours or not self.station_index:
+            return {}
+
+        # Hours are sorted, so each date is a contiguous run along the hour axis
+        dates, starts = [], []
+        for i, hour in enumerate(hours):
+            date_part = day_of[hour] if day_of else hour[:10]
+            if not dates or date_part != dates[-1]:
+                dates.append(date_part)
+                starts.append(i)
+
+        with np.errstate(invalid="ignore"):
+            maxima = np.fmax.reduceat(self.values, starts, axis=1)  # stations × dates × variables
+            minima = np.fmin.reduceat(self.values, starts, axis=1)
+
+        # Back to the shortest decimal that round-trips through float32 (12.3, not 12.300000190734863)
+        maxima = maxima.astype(str).astype(np.float64)
+        minima = minima.astype(str).astype(np.float64)
+
+        station_ids = list(self.station_index)
+        json_data = {}
+        for d, date_part in enumerate(dates):
+            has_temp = ~np.isnan(maxima[:, d, TEMP])
+            if not has_temp.any():
                 continue
-            key = (date_part, str(station_id))
-            if key not in daily_by_date_station:
-                daily_by_date_station[key] = {
-                    "temps": [], "hums": [], "winds": [], "precs": []
+            day_max = np.where(np.isnan(maxima[:, d]), -99.0, maxima[:, d]).tolist()
+            day_min = np.where(np.isnan(minima[:, d]), -99.0, minima[:, d]).tolist()
+            prec = np.where(np.isnan(maxima[:, d, PREC]), 0.0, maxima[:, d, PREC]).tolist()
+            json_data[date_part] = {
+                station_ids[s]: {
+                    "temp_max": day_max[s][TEMP],
+                    "temp_min": day_min[s][TEMP],
+                    "vento_int_max_inst": day_max[s][WIND],
+                    "prec_quant": prec[s],
+                    "hum_max": day_max[s][HUM],
+                    "hum_min": day_min[s][HUM],
                 }
-            t = obs.get("temperatura")
-            h = obs.get("humidade")
-            w = obs.get("intensidadeVentoKM")
-            p = obs.get("precAcumulada")
-            if _is_valid(t):
-                daily_by_date_station[key]["temps"].append(t)
-            if _is_valid(h):
-                daily_by_date_station[key]["hums"].append(h)
-            if _is_valid(w):
-                daily_by_date_station[key]["winds"].append(w)
-            if p is not None and p >= 0:  # prec can be 0
-                daily_by_date_station[key]["precs"].append(p)
-
-    # Build output in bot.fogos.pt format: {date: {stationId: {temp_max, temp_min, ...}}}
-    json_data = {}
-    for (date_part, station_id), agg in daily_by_date_station.items():
-        if not agg["temps"]:  # need at least temp data
-            continue
-        row = {
-            "temp_max": max(agg["temps"]),
-            "temp_min": min(agg["temps"]),
-            "vento_int_max_inst": max(agg["winds"]) if agg["winds"] else -99.0,
-            "prec_quant": max(agg["precs"]) if agg["precs"] else 0.0,
-            "hum_max": max(agg["hums"]) if agg["hums"] else -99.0,
-            "hum_min": min(agg["hums"]) if agg["hums"] else -99.0,
-        }
-        if date_part not in json_data:
-            json_data[date_part] = {}
-        json_data[date_part][station_id] = row
+                for s in np.flatnonzero(has_temp).tolist()
+            }
+        return json_data
+
+
+# ---------------------------------------
+#    LOCAL OBSERVATION STORE (SQLITE)
+# ---------------------------------------
+
+# Every hourly reading ever fetched is merged into a local SQLite file, and the
+# daily aggregates are kept up to date as hours land. A report can then be
+# built even once IPMA's rolling window has moved past part of the day.
+OBSERVATION_STORE_FILE = Path("cache") / "observations.sqlite"
+# OBSERVATION_STORE=0 aggregates straight from the live feed instead
+OBSERVATION_STORE_ENABLED = os.environ.get("OBSERVATION_STORE", "1") == "1"
+OBSERVATION_STORE_RETENTION_DAYS = int(os.environ.get("OBSERVATION_STORE_RETENTION_DAYS", "90"))
+
+
+def _clean_reading(obs):
+    """(temp, hum, wind, prec) with IPMA's invalid readings turned into None."""
+    t, h, w, p = (obs.get(name) for name in CUBE_VARIABLES)
+    return (
+        None if t is None or t == -99.0 else t,
+        None if h is None or h == -99.0 else h,
+        None if w is None or w == -99.0 else w,
+        None if p is None or p < 0 else p,  # prec can be 0
+    )
+
+
+def _fold_sql(column, fn):
+    """UPSERT expression folding excluded.column into column with fn, ignoring NULLs."""
+    return (f"{column} = CASE WHEN excluded.{column} IS NULL THEN {column} "
+            f"WHEN {column} IS NULL THEN excluded.{column} ELSE {fn}({column}, excluded.{column}) END")
+
+
+class ObservationStore:
+    """
+    SQLite store of hourly IPMA observations keyed by (station, hour), with a
+    daily table (per REPORT_TIMEZONE date) updated incrementally on merge.
+    Each incoming (station, hour) row is compared with the stored one: only
+    rows that are new (including late reports for hours already seen) or
+    revised are written, and only their station-days are touched.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS hourly (
+            station TEXT NOT NULL, hour TEXT NOT NULL, date TEXT NOT NULL,
+            temp REAL, hum REAL, wind REAL, prec REAL,
+            PRIMARY KEY (station, hour)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS hourly_by_date ON hourly (date, hour);
+        CREATE TABLE IF NOT EXISTS daily (
+            date TEXT NOT NULL, station TEXT NOT NULL,
+            temp_max REAL, temp_min REAL, wind_max REAL, prec_max REAL, hum_max REAL, hum_min REAL,
+            PRIMARY KEY (date, station)
+        ) WITHOUT ROWID;
+    """
+
+    DAILY_FROM_HOURLY = """
+        SELECT date, station, MAX(temp), MIN(temp), MAX(wind), MAX(prec), MAX(hum), MIN(hum)
+        FROM {source} {where} GROUP BY date, station
+    """
+
+    def __init__(self, path=OBSERVATION_STORE_FILE, tz_name=REPORT_TIMEZONE):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.tz_name = tz_name
+        self.db = sqlite3.connect(path)
+        self.db.executescript(self.SCHEMA)
+        self._dates = {}
+        stored_tz = self.db.execute("SELECT value FROM meta WHERE key = 'report_timezone'").fetchone()
+        if stored_tz is None or stored_tz[0] != tz_name:
+            self._rebuild_dates()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _date_of(self, hour):
+        """Report date of a feed hour key, in the store's timezone."""
+        if hour not in self._dates:
+            instant = datetime.fromisoformat(hour).replace(tzinfo=IPMA_FEED_TIMEZONE)
+            self._dates[hour] = instant.astimezone(ZoneInfo(self.tz_name)).strftime("%Y-%m-%d")
+        return self._dates[hour]
+
+    def _rebuild_dates(self):
+        """Re-derive every row's date (the report timezone changed) and recompute daily."""
+        with self.db:
+            hours = [row[0] for row in self.db.execute("SELECT DISTINCT hour FROM hourly")]
+            self.db.executemany("UPDATE hourly SET date = ? WHERE hour = ?", [(self._date_of(h), h) for h in hours])
+            self.db.execute("DELETE FROM daily")
+            self.db.execute("INSERT INTO daily " + self.DAILY_FROM_HOURLY.format(source="hourly", where=""))
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('report_timezone', ?)", (self.tz_name,))
+
+    def merge(self, records):
+        """
+        Upsert (hour, stationId, obs) records. Returns the number of hourly
+        rows that were new or changed; only those touch the daily table.
+        records may be a streaming iterator: rows go straight into SQLite as
+        they are produced, so the feed is never held in memory.
+        """
+        rows = (
+            (str(station_id), hour, self._date_of(hour), *_clean_reading(obs))
+            for hour, station_id, obs in records
+            if obs is not None
+        )
+
+        with self.db:
+            self.db.execute("CREATE TEMP TABLE IF NOT EXISTS incoming AS SELECT * FROM hourly WHERE 0")
+            self.db.execute("DELETE FROM temp.incoming")
+            self.db.executemany("INSERT OR REPLACE INTO temp.incoming VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            if self.db.execute("SELECT 1 FROM temp.incoming LIMIT 1").fetchone() is None:
+                return 0
+
+            # Revised readings can lower a max, so those station-days are recomputed
+            changed = self.db.execute("""
+                SELECT DISTINCT i.date, i.station FROM temp.incoming i JOIN hourly h USING (station, hour)
+                WHERE i.temp IS NOT h.temp OR i.hum IS NOT h.hum OR i.wind IS NOT h.wind OR i.prec IS NOT h.prec
+            """).fetchall()
+            self.db.execute("""
+                DELETE FROM temp.incoming WHERE EXISTS (
+                    SELECT 1 FROM hourly h WHERE h.station = incoming.station AND h.hour = incoming.hour
+                    AND h.temp IS incoming.temp AND h.hum IS incoming.hum
+                    AND h.wind IS incoming.wind AND h.prec IS incoming.prec)
+            """)
+            merged = self.db.execute("SELECT COUNT(*) FROM temp.incoming").fetchone()[0]
+            self.db.execute("INSERT OR REPLACE INTO hourly SELECT * FROM temp.incoming")
+
+            # New rows only ever widen a station-day's extremes; revised ones are recomputed below
+            self.db.execute(
+                "INSERT INTO daily " + self.DAILY_FROM_HOURLY.format(source="temp.incoming", where="WHERE 1")
+                + " ON CONFLICT (date, station) DO UPDATE SET "
+                + ", ".join([
+                    _fold_sql("temp_max", "max"), _fold_sql("temp_min", "min"), _fold_sql("wind_max", "max"),
+                    _fold_sql("prec_max", "max"), _fold_sql("hum_max", "max"), _fold_sql("hum_min", "min"),
+                ])
+            )
+            for date_part, station_id in changed:
+                self.db.execute("DELETE FROM daily WHERE date = ? AND station = ?", (date_part, station_id))
+                self.db.execute(
+                    "INSERT INTO daily " + self.DAILY_FROM_HOURLY.format(source="hourly", where="WHERE date = ? AND station = ?"),
+                    (date_part, station_id),
+                )
+        return merged
+
+    def prune(self, keep_days=OBSERVATION_STORE_RETENTION_DAYS):
+        """Drop hourly and daily rows older than keep_days."""
+        cutoff = (datetime.now(ZoneInfo(self.tz_name)) - timedelta(days=keep_days)).strftime("%Y-%m-%d")
+        with self.db:
+            self.db.execute("DELETE FROM hourly WHERE date < ?", (cutoff,))
+            self.db.execute("DELETE FROM daily WHERE date < ?", (cutoff,))
+
+    def hours(self, date_part):
+        """Feed hour keys stored for a report date, in order."""
+        return [row[0] for row in self.db.execute(
+            "SELECT DISTINCT hour FROM hourly WHERE date = ? ORDER BY hour", (date_part,))]
+
+    def daily_aggregates(self, date_part):
+        """One report date's daily values, in the same format as ObservationCube.daily_aggregates."""
+        stations = {}
+        for station_id, t_max, t_min, w_max, p_max, h_max, h_min in self.db.execute(
+                "SELECT station, temp_max, temp_min, wind_max, prec_max, hum_max, hum_min FROM daily "
+                "WHERE date = ? AND temp_max IS NOT NULL", (date_part,)):
+            stations[station_id] = {
+                "temp_max": t_max,
+                "temp_min": t_min,
+                "vento_int_max_inst": -99.0 if w_max is None else w_max,
+                "prec_quant": 0.0 if p_max is None else p_max,
+                "hum_max": -99.0 if h_max is None else h_max,
+                "hum_min": -99.0 if h_min is None else h_min,
+            }
+        return {date_part: stations} if stations else {}
+
+
+# ---------------------------------------
+#   CONDITIONAL GET CACHE FOR IPMA
+# ---------------------------------------
+
+# The last observations.json body is kept (gzipped) with its ETag/Last-Modified,
+# together with the daily aggregates built from it. Retries revalidate with
+# If-None-Match/If-Modified-Since and reuse them on 304 Not Modified.
+OBSERVATIONS_CACHE_DIR = Path("cache") / "observations"
+# IPMA_HTTP_CACHE=0 always downloads observations.json unconditionally
+IPMA_HTTP_CACHE = os.environ.get("IPMA_HTTP_CACHE", "1") == "1"
+
+
+def _read_observations_cache_meta():
+    """Validators of the cached body, or {} if there is no usable cache."""
+    try:
+        meta = json.loads((OBSERVATIONS_CACHE_DIR / "meta.json").read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return {}
+    if not (OBSERVATIONS_CACHE_DIR / "observations.json.gz").exists():
+        return {}
+    return meta
+
+
+def _conditional_headers(meta):
+    headers = dict(HEADERS)
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    return headers
+
+
+def _validator(meta):
+    return f"{meta.get('etag')}|{meta.get('last_modified')}"
+
+
+def _aggregate_cache_path(yesterday_date):
+    return OBSERVATIONS_CACHE_DIR / f"aggregate-{yesterday_date}-{REPORT_TIMEZONE.replace('/', '_')}.json"
+
+
+def _read_cached_aggregate(yesterday_date, meta):
+    """Aggregates previously built for yesterday_date from the cached body, if any."""
+    try:
+        cached = json.loads(_aggregate_cache_path(yesterday_date).read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return None
+    if cached.get("validator") != _validator(meta):
+        return None
+    return cached["json_data"]
+
+
+def _write_cached_aggregate(yesterday_date, meta, json_data):
+    path = _aggregate_cache_path(yesterday_date)
+    # Aggregates for older bodies are useless once the body is replaced
+    for old in OBSERVATIONS_CACHE_DIR.glob("aggregate-*.json"):
+        if old != path:
+            old.unlink()
+    path.write_text(json.dumps({"validator": _validator(meta), "json_data": json_data}), encoding="utf-8")
+
+
+def _tee_to_cache(chunks, tmp_body):
+    """Pass byte chunks through while writing them to a gzipped cache file."""
+    with gzip.open(tmp_body, "wb", compresslevel=1) as f:
+        for chunk in chunks:
+            f.write(chunk)
+            yield chunk
+
+
+def _iter_cached_body_chunks(chunk_size=IPMA_STREAM_CHUNK_SIZE):
+    with gzip.open(OBSERVATIONS_CACHE_DIR / "observations.json.gz", "rt", encoding="utf-8") as f:
+        for chunk in iter(lambda: f.read(chunk_size), ""):
+            yield chunk
+
+
+def _aggregate_report_day(records, hourly_keys, yesterday_date, use_store=OBSERVATION_STORE_ENABLED):
+    """
+    Fold (hour, stationId, obs) records into the report day's daily aggregates.
+    hourly_keys must be the list the record iterator appends hour keys to.
+    With use_store set, records are merged into the local ObservationStore and
+    the day is read back from it, including hours the live feed no longer has.
+    """
+    if use_store:
+        with METRICS.span("aggregate"), ObservationStore() as store:
+            merged = store.merge(records)
+            store.prune()
+            json_data = store.daily_aggregates(yesterday_date)
+            json_data["_hourly_keys"] = store.hours(yesterday_date)
+        METRICS.count("observation_rows_merged", merged)
+        logger.info(f"Observation store: merged {merged} new hourly rows, {len(json_data.get(yesterday_date, {}))} stations for {yesterday_date}")
+        return json_data
+
+    day_hours = set(report_day_hours(yesterday_date))
+
+    # Collect the report day's hourly readings into a stations × hours × variables cube
+    # IPMA: temperatura, humidade, intensidadeVentoKM, precAcumulada
+    with METRICS.span("aggregate"):
+        cube = ObservationCube()
+        for dt_str, station_id, obs in records:
+            if dt_str in day_hours:
+                cube.add(dt_str, station_id, obs)
+
+        # Daily max/min/accumulation for every station in one reduction over the hour axis
+        json_data = cube.daily_aggregates(day_of=dict.fromkeys(day_hours, yesterday_date))
 
     logger.info(f"IPMA API: aggregated {len(json_data)} dates, {sum(len(v) for v in json_data.values())} station-days")
 
-    json_data["_hourly_keys"] = hourly_keys
+    json_data["_hourly_keys"] = sorted(day_hours.intersection(hourly_keys))
+    return json_data
+
 
+def fetch_from_ipma_api(yesterday_date, streaming=IPMA_STREAMING, http_cache=IPMA_HTTP_CACHE, cancel=None):
+    """
+    Fetch from official IPMA API (no Cloudflare) and aggregate hourly → daily.
+    Only hours that belong to yesterday_date (see report_day_hours) are
+    aggregated; everything else in the rolling window is dropped on arrival.
+    With streaming set, the body is parsed in chunks and each station record
+    is added to the observation cube as it arrives. With http_cache set, the
+    request is conditional and a 304 reuses the cached aggregates (or body).
+    Setting the cancel event stops a streamed download with FetchCancelled.
+    Returns json_data in same format as bot.fogos.pt: {yesterday_date: {stationId: {temp_max, ...}}}
+    """
+    logger.info(f"Fetching from IPMA API (fallback): {URL_IPMA_API}")
+    meta = _read_observations_cache_meta() if http_cache else {}
+    headers = _conditional_headers(meta) if meta else HEADERS
+    hourly_keys = []
+
+    with HTTP.get(URL_IPMA_API, headers=headers, stream=streaming, cancel=cancel) as r:
+        if r.status_code == 304 and meta:
+            logger.info("IPMA API: observations.json not modified, reusing cached copy")
+            METRICS.count("cache_hits", cache="observations_http")
+            cached = _read_cached_aggregate(yesterday_date, meta)
+            if cached is not None:
+                METRICS.count("cache_hits", cache="observations_aggregate")
+                return cached
+            METRICS.count("cache_misses", cache="observations_aggregate")
+            records = _iter_hourly_records(_iter_cached_body_chunks(), hourly_keys)
+            json_data = _aggregate_report_day(records, hourly_keys, yesterday_date)
+            _write_cached_aggregate(yesterday_date, meta, json_data)
+            return json_data
+
+        r.raise_for_status()
+        if meta:
+            METRICS.count("cache_misses", cache="observations_http")
+        if not http_cache:
+            if streaming:
+                chunks = _cancellable(_count_bytes(r.iter_content(chunk_size=IPMA_STREAM_CHUNK_SIZE), "ipma"), cancel)
+                records = _iter_hourly_records(_iter_text_chunks(chunks, r.encoding), hourly_keys)
+            else:
+                METRICS.count("bytes_in", len(r.content), source="ipma")
+                records = _iter_records_from_dict(r.json(), hourly_keys)
+            return _aggregate_report_day(records, hourly_keys, yesterday_date)
+
+        OBSERVATIONS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_body = OBSERVATIONS_CACHE_DIR / "observations.json.gz.tmp"
+        if streaming:
+            chunks = _tee_to_cache(_cancellable(_count_bytes(r.iter_content(chunk_size=IPMA_STREAM_CHUNK_SIZE), "ipma"), cancel), tmp_body)
+            records = _iter_hourly_records(_iter_text_chunks(chunks, r.encoding), hourly_keys)
+            json_data = _aggregate_report_day(records, hourly_keys, yesterday_date)
+            # The parser stops at the closing brace; copy any trailing bytes too
+            for _ in chunks:
+                pass
+        else:
+            METRICS.count("bytes_in", len(r.content), source="ipma")
+            with gzip.open(tmp_body, "wb", compresslevel=1) as f:
+                f.write(r.content)
+            records = _iter_records_from_dict(r.json(), hourly_keys)
+            json_data = _aggregate_report_day(records, hourly_keys, yesterday_date)
+
+        meta = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+
+    if _save_observations_cache(tmp_body, meta, hourly_keys):
+        _write_cached_aggregate(yesterday_date, meta, json_data)
     return json_data
 
 
-def fetch_observations_data(yesterday_date):
+def _save_observations_cache(tmp_body, meta, hourly_keys):
+    """
+    Keep a fully downloaded body with its validators and the hour keys it
+    contains. Returns False (and drops it) if there is nothing to revalidate with.
+    """
+    if not (meta["etag"] or meta["last_modified"]):
+        tmp_body.unlink(missing_ok=True)
+        return False
+    tmp_body.replace(OBSERVATIONS_CACHE_DIR / "observations.json.gz")
+    meta = dict(meta, hours=sorted(set(hourly_keys)))
+    (OBSERVATIONS_CACHE_DIR / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    return True
+
+
+# ---------------------------------------
+#     REPORT DAY COMPLETENESS PROBE
+# ---------------------------------------
+
+# Before the deadline, a run only ingests the feed once the report day has at
+# least MIN_REPORT_HOURS hours; earlier attempts give up as cheaply as possible.
+MIN_REPORT_HOURS = 23
+REPORT_DEADLINE_HOUR = 5  # Europe/Lisbon
+# IPMA_PROBE=0 always downloads and aggregates the full feed before deciding
+IPMA_PROBE = os.environ.get("IPMA_PROBE", "1") == "1"
+
+# Hour keys are the only ISO timestamps used as object keys in the feed
+_HOUR_KEY = r'"(\d{4}-\d\d-\d\dT\d\d:\d\d)"\s*:\s*\{'
+
+
+def _scan_hour_keys(text_chunks, wanted):
+    """
+    Collect hour keys from a streamed feed without decoding any station
+    record, stopping as soon as every key in wanted has been seen.
+    Returns (keys seen, whether the whole body was read).
+    """
+    seen, tail = set(), ""
+    for chunk in text_chunks:
+        buf = tail + chunk
+        seen.update(re.findall(_HOUR_KEY, buf))
+        if wanted <= seen:
+            return seen, False
+        # A key split across chunks is completed by the next one
+        tail = buf[-32:]
+    return seen, True
+
+
+def probe_report_day(yesterday_date, http_cache=IPMA_HTTP_CACHE, use_store=OBSERVATION_STORE_ENABLED):
+    """
+    Work out whether IPMA has published the report day's hours, cheapest
+    source first: hours already in the local store, then a conditional
+    request answered from the cached hour set on 304, then a streamed read
+    that stops once every hour key has been seen. A body read to the end is
+    kept in the observations cache so the next attempt can revalidate it.
+    Returns (complete, report day hours seen, source).
+    """
+    day_hours = report_day_hours(yesterday_date)
+    wanted = set(day_hours)
+
+    def result(hours, source):
+        hours = sorted(wanted.intersection(hours))
+        return len(hours) >= MIN_REPORT_HOURS, hours, source
+
+    if use_store and OBSERVATION_STORE_FILE.exists():
+        with ObservationStore() as store:
+            stored = store.hours(yesterday_date)
+        if len(stored) >= MIN_REPORT_HOURS:
+            return result(stored, "store")
+
+    meta = _read_observations_cache_meta() if http_cache else {}
+    headers = _conditional_headers(meta) if meta else HEADERS
+    with HTTP.get(URL_IPMA_API, headers=headers, stream=True) as r:
+        if r.status_code == 304 and meta:
+            METRICS.count("cache_hits", cache="observations_http")
+            if "hours" in meta:
+                return result(meta["hours"], "cached hours")
+            hours, _ = _scan_hour_keys(_iter_cached_body_chunks(), wanted)
+            return result(hours, "cached body")
+        r.raise_for_status()
+        if meta:
+            METRICS.count("cache_misses", cache="observations_http")
+
+        if not http_cache:
+            hours, _ = _scan_hour_keys(_iter_text_chunks(_count_bytes(r.iter_content(chunk_size=IPMA_STREAM_CHUNK_SIZE), "ipma"), r.encoding), wanted)
+            return result(hours, "partial read")
+
+        OBSERVATIONS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_body = OBSERVATIONS_CACHE_DIR / "observations.json.gz.tmp"
+        chunks = _tee_to_cache(_count_bytes(r.iter_content(chunk_size=IPMA_STREAM_CHUNK_SIZE), "ipma"), tmp_body)
+        hours, read_all = _scan_hour_keys(_iter_text_chunks(chunks, r.encoding), wanted)
+        chunks.close()
+        if not read_all:
+            tmp_body.unlink(missing_ok=True)
+            return result(hours, "partial read")
+        meta = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+
+    _save_observations_cache(tmp_body, meta, hours)
+    return result(hours, "full read")
+
+
+# ---------------------------------------
+#     HEDGED FETCH WITH BACKOFF
+# ---------------------------------------
+
+# IPMA is asked first; bot.fogos.pt is also started if IPMA hasn't answered
+# after FETCH_HEDGE_DELAY seconds (or as soon as it fails), and the first
+# source that has the report day wins. Transient errors are retried inside
+# HTTP.get with the shared backoff policy.
+FETCH_HEDGE_DELAY = float(os.environ.get("FETCH_HEDGE_DELAY", "20"))
+
+
+def _cancellable(chunks, cancel):
+    """Pass chunks through until cancel is set (or HTTP.abort cuts the read short)."""
+    try:
+        for chunk in chunks:
+            if cancel is not None and cancel.is_set():
+                raise FetchCancelled("download cancelled")
+            yield chunk
+    except requests.exceptions.RequestException as e:
+        if cancel is not None and cancel.is_set():
+            raise FetchCancelled("download cancelled") from e
+        raise
+
+
+def fetch_from_bot_fogos(yesterday_date, cancel=None):
+    """bot.fogos.pt's daily observations page (may be rate-limited or blocked by Cloudflare)."""
+    logger.info(f"Fetching from {URL_BOT_FOGOS}")
+    page = HTTP.get(URL_BOT_FOGOS, headers=HEADERS, cancel=cancel)
+    METRICS.count("bytes_in", len(page.content), source="bot.fogos.pt")
+    if page.status_code == 429:
+        raise RuntimeError("Rate limited (429)")
+    if "Access denied" in page.text and "Cloudflare" in page.text:
+        raise RuntimeError("Cloudflare blocked")
+    page.raise_for_status()
+    search = re.search(r'var observations = (.*?);', page.text, re.DOTALL)
+    if not search:
+        raise RuntimeError("No observations found on bot.fogos.pt")
+    return json.loads(search.group(1))
+
+
+# Sources in order of preference: (name, fetch(yesterday_date, cancel=...))
+OBSERVATION_SOURCES = (
+    ("ipma", fetch_from_ipma_api),
+    ("bot.fogos.pt", fetch_from_bot_fogos),
+)
+
+
+def fetch_observations_data(yesterday_date, sources=OBSERVATION_SOURCES, hedge_delay=FETCH_HEDGE_DELAY):
     """
     Fetch IPMA observations. Uses official IPMA API first (works from GitHub Actions);
-    falls back to bot.fogos.pt only if IPMA API fails (e.g. local network issues).
+    bot.fogos.pt is raced against it after hedge_delay seconds (never, if
+    hedge_delay is None), or started at once if IPMA fails. The first response
+    containing yesterday_date wins; the other source is cancelled and waited
+    for, so no fetch thread outlives the call.
     Returns json_data dict in format {date: {stationId: {...}}}.
     """
-    # Use IPMA API first - no Cloudflare, works from GitHub Actions and locally
-    try:
-        data = fetch_from_ipma_api(yesterday_date)
-        if data and yesterday_date in data:
-            logger.info("Using IPMA API data")
-            return data
-        logger.warning("IPMA API returned no data for yesterday, trying bot.fogos.pt")
-    except Exception as e:
-        logger.warning(f"IPMA API failed: {e}. Trying bot.fogos.pt fallback.")
+    cancel = threading.Event()
+    results = queue.Queue()
+    parent_spans = METRICS.current()
+    threads = []
 
-    # Fallback to bot.fogos.pt (may be rate-limited from GitHub Actions)
-    try:
-        logger.info(f"Fetching from {URL_BOT_FOGOS}")
-        page = requests.get(URL_BOT_FOGOS, headers=HEADERS, timeout=30)
-        if page.status_code == 429:
-            raise RuntimeError("Rate limited (429)")
-        if "Access denied" in page.text and "Cloudflare" in page.text:
-            raise RuntimeError("Cloudflare blocked")
-        page.raise_for_status()
-        search = re.search(r'var observations = (.*?);', page.text, re.DOTALL)
-        if search:
-            data = json.loads(search.group(1))
-            logger.info("Using bot.fogos.pt data")
+    def run(name, fetch):
+        METRICS.inherit(parent_spans)
+        try:
+            with METRICS.span(name):
+                data = fetch(yesterday_date, cancel=cancel)
+            if not data or yesterday_date not in data:
+                raise RuntimeError(f"no data for {yesterday_date}")
+            results.put((name, data, None))
+        except Exception as e:
+            results.put((name, None, e))
+
+    def start(index):
+        thread = threading.Thread(target=run, args=sources[index], name=f"fetch-{sources[index][0]}", daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    start(0)
+    started, pending, last_error = 1, 1, None
+    while pending:
+        try:
+            name, data, error = results.get(timeout=hedge_delay if started < len(sources) else None)
+        except queue.Empty:
+            logger.info(f"No answer after {hedge_delay:.0f}s, also trying {sources[started][0]}")
+            METRICS.count("fetch_hedges", source=sources[started][0])
+            start(started)
+            started, pending = started + 1, pending + 1
+            continue
+
+        pending -= 1
+        if error is None:
+            # Shutting down the loser's socket ends a read blocked on a slow host
+            # right away, so the join below is short. Waiting for it means no fetch
+            # thread can be holding a lock when render_reports forks its process pool.
+            HTTP.abort(cancel)
+            logger.info(f"Using {name} data")
+            METRICS.info["source"] = name
+            for thread in threads:
+                thread.join()
             return data
-    except Exception as e:
-        logger.error(f"bot.fogos.pt also failed: {e}")
-        raise RuntimeError(
-            "Could not fetch weather data. Both IPMA API and bot.fogos.pt failed."
-        ) from e
 
-    raise RuntimeError("Could not fetch weather data from any source.")
+        logger.warning(f"{name} failed: {error}")
+        last_error = error
+        if started < len(sources):
+            METRICS.count("fetch_fallbacks", source=sources[started][0])
+            start(started)
+            started, pending = started + 1, pending + 1
 
+    raise RuntimeError(
+        "Could not fetch weather data. Both IPMA API and bot.fogos.pt failed."
+    ) from last_error
 
-# Check yesterday's date early (needed for IPMA fallback)
-yesterday = datetime.now() - timedelta(1)
-yesterday_date = datetime.strftime(yesterday, '%Y-%m-%d')
 
-locks_dir = Path("locks")
-locks_dir.mkdir(exist_ok=True)
+def build_station_table(json_data, yesterday_date):
+    """
+    Create the Dataframe from yesterday's json data only; other dates (e.g.
+    from the bot.fogos.pt fallback, which returns its whole window) are never built.
+    """
+    if yesterday_date not in json_data:
+        raise RuntimeError(f"No observations available for {yesterday_date}")
 
-# Delete old lock files
-for old_lock in locks_dir.glob("generated_*.lock"):
-    if yesterday_date not in old_lock.name:
-        old_lock.unlink()
+    ipma_data_yesterday = pd.concat({yesterday_date: pd.DataFrame(json_data[yesterday_date]).T}, axis=0).reset_index()
 
-# Today's lock file
-lock_file = locks_dir / f"generated_{yesterday_date}.lock"
+    # Debug dump, opt-in with WRITE_CHECK_CSV=1
+    if WRITE_CHECK_CSV:
+        ipma_data_yesterday.to_csv("check.csv")
 
-# Skip if already generated
-if lock_file.exists():
-    print(f"Report for {yesterday_date} already generated. Skipping.")
-    sys.exit(0)
+    # Rename resulting level_x columns
+    return ipma_data_yesterday.rename(columns={'level_0': 'date','level_1':'stationId'})
 
-# Fetch data (bot.fogos.pt or IPMA API fallback)
-json_data = fetch_observations_data(yesterday_date)
 
-hourly_keys = json_data.pop("_hourly_keys", [])
+# Define function to fetch stationId's raw metadata, raising on any failure
+def _request_station_json(id):
+    # Try the v2 endpoint first
+    url_bar = f"{URL_FOGOS_STATIONS_V2}?id={id}"
+    logger.info(f"Trying v2 endpoint: {url_bar}")
+    response_id = HTTP.get(url_bar)
+    logger.info(f"V2 response status: {response_id.status_code}")
 
-print(f"Fetched data for {len(json_data)} dates")
+    # If v2 fails, try v1 endpoint as fallback
+    if response_id.status_code != 200:
+        url_bar = f"{URL_FOGOS_STATIONS_V1}?id={id}"
+        logger.info(f"Trying v1 endpoint: {url_bar}")
+        METRICS.count("endpoint_fallbacks", source="fogos_station")
+        response_id = HTTP.get(url_bar)
+        logger.info(f"V1 response status: {response_id.status_code}")
 
-hours_yesterday = sorted([
-    dt for dt in hourly_keys
-    if dt.startswith(yesterday_date)
-])
+    response_id.raise_for_status()
+    METRICS.count("bytes_in", len(response_id.content), source="fogos_station")
 
-hour_count = len(hours_yesterday)
-now_lisbon = datetime.now(ZoneInfo("Europe/Lisbon"))
+    # Debug the response
+    logger.debug(f"Response content: {response_id.text}")
 
-print(f"Hours available for {yesterday_date}: {hours_yesterday}")
-print(f"Hour count: {hour_count}")
-print(f"Current Lisbon time: {now_lisbon:%Y-%m-%d %H:%M:%S}")
+    # Check if response is empty
+    if not response_id.text:
+        raise ValueError("Empty response received")
 
-if hour_count < 23 and now_lisbon.hour < 5:
-    print(
-        f"Incomplete data ({hour_count} hours) "
-        f"and before 05:00 Lisbon time. Skipping."
-    )
-    sys.exit(0)
+    try:
+        json_id = response_id.json()
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSON decode error: {e}; response content was: {response_id.text[:200]}...") from e
+    if not json_id:
+        raise ValueError("Empty JSON received")
+
+    # Log the structure of the response
+    logger.debug(f"JSON structure: {json_id.keys() if isinstance(json_id, dict) else 'not a dict'}")
 
-print("Proceeding with report generation.")
+    return json_id
 
-# Create Dataframe from json data
 
-ipma_data = pd.concat({k: pd.DataFrame(v).T for k, v in json_data.items()}, axis=0).reset_index()
+# ---------------------------------------
+#     BATCHED STATION LOOKUPS
+# ---------------------------------------
 
-ipma_data.to_csv("check.csv")
+# Lookups run on a bounded thread pool over the shared HTTP client, whose
+# api.fogos.pt budget keeps us under the rate limit regardless of pool size.
+STATION_LOOKUP_WORKERS = int(os.environ.get("STATION_LOOKUP_WORKERS", "8"))
 
-#print (ipma_data.info())
-# Rename resulting level_x columns
+# Result of one batched lookup: record is None and error is set when it failed
+StationLookup = namedtuple("StationLookup", ["id", "record", "error"])
 
-ipma_data = ipma_data.rename(columns={'level_0': 'date','level_1':'stationId'})
 
-#print (ipma_data.info())
+def getStationsByIds(ids, max_workers=STATION_LOOKUP_WORKERS):
+    """
+    Resolve many station ids concurrently. Returns a list of StationLookup in
+    the same order as ids; each failure is reported on its own entry instead
+    of aborting the batch.
+    """
+    ids = [str(i) for i in ids]
+    if not ids:
+        return []
 
-# Sort dataframe by date 
+    def lookup(station_id):
+        try:
+            json_id = _request_station_json(station_id)
+            record = _station_records(json_id, default_id=station_id).get(station_id)
+            if record is None:
+                raise ValueError("Station not present in response")
+            return StationLookup(station_id, record, None)
+        except Exception as e:
+            return StationLookup(station_id, None, e)
 
-ipma_data = ipma_data.sort_values(by=['date'])
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(ids))) as pool:
+        return list(pool.map(lookup, ids))
 
-report_date = str(yesterday_date)
 
-print(report_date)
+# ---------------------------------------
+#       STATION METADATA STORE
+# ---------------------------------------
 
-# Create new datafraeme with only yesterday's results
+# Station metadata (place, location, coordinates) barely ever changes, so it is
+# kept on disk and refreshed in bulk instead of asking api.fogos.pt per station.
+# Like the lock files, the cache directory is committed back by the workflow.
 
-ipma_data_yesterday = ipma_data[ipma_data['date'] == yesterday_date].copy()
+STATION_CACHE_FILE = Path("cache") / "stations.json"
+STATION_CACHE_TTL = timedelta(days=7)
 
-#print (ipma_data_yesterday.info())
+# STATION_CACHE_REFRESH=1 forces a bulk refresh even if the cache is fresh
+STATION_CACHE_FORCE_REFRESH = os.environ.get("STATION_CACHE_REFRESH", "0") == "1"
+# STATION_CACHE_STALE_OK=0 makes a failed refresh fatal instead of reusing a stale cache
+STATION_CACHE_STALE_OK = os.environ.get("STATION_CACHE_STALE_OK", "1") == "1"
 
 
-# Define function to fetch stationId's name 
-def getStationNameById(id):
-    headers = {
-        "User-Agent": "VostPTExtremosMeteo/1.0",
-    }
-    
-    try:
-        # Try the v2 endpoint first
-        url_bar = f"https://api.fogos.pt/v2/weather/stations?id={id}"
-        logger.info(f"Trying v2 endpoint: {url_bar}")
-        response_id = requests.get(url_bar, headers=headers, timeout=30)
-        logger.info(f"V2 response status: {response_id.status_code}")
-        
-        # If v2 fails, try v1 endpoint as fallback
-        if response_id.status_code != 200:
-            url_bar = f"https://api.fogos.pt/v1/weather/stations?id={id}"
-            logger.info(f"Trying v1 endpoint: {url_bar}")
-            response_id = requests.get(url_bar, headers=headers, timeout=30)
-            logger.info(f"V1 response status: {response_id.status_code}")
-        
-        response_id.raise_for_status()
-        
-        # Debug the response
-        logger.debug(f"Response content: {response_id.text}")
-        
-        # Check if response is empty
-        if not response_id.text:
-            logger.error(f"Empty response received for station ID {id}")
-            return None
-        
-        # Add more detailed error logging
-        try:
-            json_id = response_id.json()
-            if not json_id:
-                logger.error(f"Empty JSON received for station ID {id}")
-                return None
-            
-            # Log the structure of the response
-            logger.debug(f"JSON structure: {json_id.keys() if isinstance(json_id, dict) else 'not a dict'}")
-            
-            df_id = pd.json_normalize(json_id)
-            return df_id
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error for station ID {id}: {e}")
-            logger.error(f"Response content was: {response_id.text[:200]}...")  # Log first 200 chars
-            return None
-        
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Request error for station ID {id}: {e}")
+def _station_coordinates(record):
+    """Extract (lat, lon) from a station record, whatever shape the API used."""
+    coords = record.get("coordinates")
+    if isinstance(coords, dict):
+        lat = coords.get("lat", coords.get("latitude"))
+        lon = coords.get("lng", coords.get("lon", coords.get("longitude")))
+    elif isinstance(coords, (list, tuple)) and len(coords) == 2:
+        lat, lon = coords
+    else:
+        lat = record.get("lat", record.get("latitude"))
+        lon = record.get("lng", record.get("lon", record.get("longitude")))
+    if lat is None or lon is None:
         return None
-    except Exception as e:
-        logger.error(f"Unexpected error for station ID {id}: {e}")
+    try:
+        return [float(lat), float(lon)]
+    except (TypeError, ValueError):
         return None
 
-# Create empty list for territory
-territory = []
 
-# Get max records on dataframe
-max_records = len(ipma_data_yesterday)
+def _station_records(payload, default_id=None):
+    """Normalise an api.fogos.pt stations payload into {id: {place, location, coordinates}}."""
+    if isinstance(payload, dict):
+        payload = payload.get("data", payload)
+    if isinstance(payload, dict):
+        payload = [payload]
+    stations = {}
+    for record in payload or []:
+        station_id = record.get("id", default_id) if isinstance(record, dict) else None
+        if station_id is None:
+            continue
+        stations[str(station_id)] = {
+            "place": record.get("place"),
+            "location": record.get("location"),
+            "coordinates": _station_coordinates(record),
+        }
+    return stations
+
+
+def _read_station_cache():
+    """
+    Return (fetched_at, stations, misses) from disk, or (None, {}, {}) if there
+    is no usable cache. misses maps ids whose lookup failed to when it failed.
+    """
+    try:
+        cached = json.loads(STATION_CACHE_FILE.read_text(encoding="utf-8"))
+        misses = {station_id: datetime.fromisoformat(failed_at) for station_id, failed_at in cached.get("misses", {}).items()}
+        return datetime.fromisoformat(cached["fetched_at"]), cached["stations"], misses
+    except FileNotFoundError:
+        return None, {}, {}
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        logger.warning(f"Ignoring corrupt station cache {STATION_CACHE_FILE}: {e}")
+        return None, {}, {}
+
+
+def _write_station_cache(fetched_at, stations, misses=None):
+    STATION_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = STATION_CACHE_FILE.with_suffix(".tmp")
+    tmp.write_text(
+        json.dumps({"fetched_at": fetched_at.isoformat(), "stations": stations,
+                    "misses": {station_id: failed_at.isoformat() for station_id, failed_at in (misses or {}).items()}},
+                   ensure_ascii=False, indent=1, sort_keys=True),
+        encoding="utf-8",
+    )
+    tmp.replace(STATION_CACHE_FILE)
 
-# Add logging for dataframe info
-logger.info(f"Processing {max_records} records from {yesterday_date}")
-logger.info(f"Sample station IDs: {ipma_data_yesterday['stationId'].head().tolist()}")
 
-# Get territory for each station on the Dataframe 
-for x in range(max_records):
-    info = getStationNameById(ipma_data_yesterday.iloc[x].stationId)
-    if info is None:
-        logger.warning(f"Could not get info for station {ipma_data_yesterday.iloc[x].stationId}, skipping...")
-        territory.append("Unknown")  # Add placeholder instead of skipping
+def _fetch_all_stations():
+    """One bulk request for every station (v2 first, v1 as fallback)."""
+    last_error = None
+    for url in (URL_FOGOS_STATIONS_V2, URL_FOGOS_STATIONS_V1):
+        try:
+            logger.info(f"Refreshing station metadata from {url}")
+            if url != URL_FOGOS_STATIONS_V2:
+                METRICS.count("endpoint_fallbacks", source="fogos_stations")
+            response = HTTP.get(url)
+            response.raise_for_status()
+            METRICS.count("bytes_in", len(response.content), source="fogos_stations")
+            stations = _station_records(response.json())
+            if stations:
+                return stations
+            last_error = RuntimeError(f"No stations returned by {url}")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            last_error = e
+            logger.warning(f"Station refresh from {url} failed: {e}")
+    raise RuntimeError("Could not refresh station metadata") from last_error
+
+
+def load_station_metadata(force_refresh=STATION_CACHE_FORCE_REFRESH, stale_ok=STATION_CACHE_STALE_OK):
+    """
+    Return {stationId: {place, location, coordinates}} from the on-disk cache,
+    refreshing it with one bulk request when it is missing, older than
+    STATION_CACHE_TTL or when force_refresh is set. If the refresh fails and
+    stale_ok is set, the stale cache is served instead; with no cache at all
+    an empty store is returned and resolve_station_metadata fills it per id.
+    """
+    fetched_at, stations, misses = _read_station_cache()
+    now = datetime.now(ZoneInfo("UTC"))
+    if not force_refresh and fetched_at is not None and now - fetched_at < STATION_CACHE_TTL:
+        logger.info(f"Using cached station metadata ({len(stations)} stations, fetched {fetched_at:%Y-%m-%d %H:%M})")
+        METRICS.count("cache_hits", cache="stations")
+        return stations
+    METRICS.count("cache_misses", cache="stations")
+
+    try:
+        fresh = _fetch_all_stations()
+    except RuntimeError:
+        if not stations:
+            logger.warning("Station refresh failed and no cache exists, falling back to per-station lookups")
+            return {}
+        if stale_ok:
+            logger.warning(f"Station refresh failed, serving stale cache from {fetched_at}")
+            METRICS.count("cache_stale_served", cache="stations")
+            return stations
+        raise
+
+    _write_station_cache(now, fresh, misses)
+    return fresh
+
+
+def resolve_station_metadata(station_ids, stations):
+    """
+    Make sure every id in station_ids is present in stations. Ids missing from
+    the bulk list (e.g. brand new stations) are looked up one by one and merged
+    into the on-disk cache, so they are only ever fetched once. Failed lookups
+    are remembered too and not retried until STATION_CACHE_TTL has passed.
+    """
+    fetched_at, _, misses = _read_station_cache()
+    now = datetime.now(ZoneInfo("UTC"))
+    misses = {station_id: failed_at for station_id, failed_at in misses.items()
+              if station_id not in stations and now - failed_at < STATION_CACHE_TTL}
+    unknown = [str(i) for i in dict.fromkeys(station_ids) if str(i) not in stations]
+    missing = [station_id for station_id in unknown if station_id not in misses]
+    if len(missing) < len(unknown):
+        logger.info(f"{len(unknown) - len(missing)} station(s) failed lookup recently, not asking again")
+        METRICS.count("cache_hits", len(unknown) - len(missing), cache="station_misses")
+    if not missing:
+        return stations
+
+    logger.info(f"{len(missing)} station(s) not in cache, looking them up individually")
+    METRICS.count("station_lookups", len(missing))
+    for result in getStationsByIds(missing):
+        if result.error is not None:
+            logger.error(f"Lookup failed for station ID {result.id}: {result.error}")
+            METRICS.count("station_lookup_errors")
+            misses[result.id] = now
+            continue
+        stations[result.id] = result.record
+
+    _write_station_cache(fetched_at or now, stations, misses)
+    return stations
+
+
+# ---------------------------------------
+#   TERRITORY LOOKUP FROM COORDINATES
+# ---------------------------------------
+
+# Stations are placed in a territory, and a finer region (island, or district
+# when REGIONS_FILE provides them), from their cached coordinates in one
+# vectorised pass, without asking api.fogos.pt. The API's "place" is only
+# used for stations without coordinates or outside every region.
+# TERRITORY_SOURCE=place uses the API's place for every station instead.
+TERRITORY_SOURCE = os.environ.get("TERRITORY_SOURCE", "coordinates")
+# Optional GeoJSON FeatureCollection of finer regions (e.g. districts): each
+# feature has "name" and "territory" properties and a (Multi)Polygon geometry
+REGIONS_FILE = Path(os.environ.get("REGIONS_FILE", "regions.geojson"))
+
+# bbox is (min_lat, min_lon, max_lat, max_lon). rings are closed [(lon, lat), ...]
+# outlines tested with the even-odd rule (holes included); None uses the box alone.
+Region = namedtuple("Region", ["name", "territory", "bbox", "rings"], defaults=(None,))
+
+
+def _outlined_region(name, territory, rings):
+    """A Region whose box is the bounding box of its outline rings."""
+    points = [point for ring in rings for point in ring]
+    bbox = (min(lat for _, lat in points), min(lon for lon, _ in points),
+            max(lat for _, lat in points), max(lon for lon, _ in points))
+    return Region(name, territory, bbox, rings)
+
+
+# Coarse (lon, lat) outlines of each territory, a few km wide of the coast so
+# coastal, lighthouse and islet stations fall inside. The mainland follows the
+# Spanish border to within a few km (Vigo, Ourense, Badajoz and Huelva are
+# outside); the archipelagos only enclose their islands, as nothing else is near.
+MAINLAND_OUTLINE = [
+    (-9.00, 41.87), (-8.75, 41.96), (-8.62, 42.06), (-8.45, 42.10), (-8.19, 42.17),  # Minho
+    (-8.22, 41.90), (-8.12, 41.79), (-7.90, 41.90), (-7.70, 41.92), (-7.45, 41.88),  # Gerês, Chaves
+    (-7.15, 41.92), (-6.95, 41.99), (-6.62, 41.97), (-6.52, 41.88), (-6.33, 41.70),  # Bragança
+    (-6.15, 41.60), (-6.21, 41.48), (-6.40, 41.33), (-6.62, 41.18), (-6.86, 41.03),  # Douro
+    (-6.79, 40.86), (-6.78, 40.60), (-6.80, 40.30), (-6.90, 40.15), (-6.86, 39.90),  # Beira
+    (-7.00, 39.66), (-7.52, 39.64), (-7.30, 39.45), (-7.22, 39.20), (-7.00, 39.10),  # Tejo, Marvão
+    (-7.02, 38.85), (-7.20, 38.70), (-7.30, 38.45), (-7.08, 38.30), (-6.92, 38.18),  # Caia, Barrancos
+    (-7.00, 38.05), (-7.24, 37.96), (-7.50, 37.56), (-7.44, 37.35), (-7.40, 37.17),  # Guadiana
+    (-7.38, 37.00), (-7.90, 36.80), (-8.90, 36.85), (-9.15, 36.95), (-9.10, 37.40),  # Algarve
+    (-9.05, 37.90), (-9.40, 38.35), (-9.65, 38.75), (-9.70, 39.45), (-9.25, 39.75),  # Espichel, Berlengas
+    (-9.05, 40.15), (-8.95, 40.64), (-8.85, 41.15), (-9.00, 41.69), (-9.00, 41.87),
+]
+ACORES_OUTLINE = [
+    (-31.50, 39.90), (-30.80, 39.90), (-28.30, 39.30), (-27.60, 39.20), (-26.70, 38.90),
+    (-25.30, 38.30), (-24.60, 37.50), (-24.70, 36.80), (-25.40, 36.75), (-26.00, 37.50),
+    (-27.20, 38.40), (-28.30, 38.20), (-29.10, 38.40), (-30.80, 39.20), (-31.50, 39.20), (-31.50, 39.90),
+]
+MADEIRA_OUTLINE = [
+    (-17.45, 32.95), (-16.55, 33.30), (-16.10, 33.20), (-16.30, 32.30), (-15.70, 30.30),  # Porto Santo, Desertas
+    (-15.70, 29.85), (-16.20, 29.85), (-16.60, 32.30), (-17.45, 32.50), (-17.45, 32.95),  # Selvagens
+]
+
+# Islands first, then whole territories; the first region containing a station wins.
+# Island boxes are padded a little so coastal and lighthouse stations fall inside.
+BUILTIN_REGIONS = (
+    Region("Corvo", "Açores", (39.64, -31.17, 39.75, -31.05)),
+    Region("Flores", "Açores", (39.34, -31.30, 39.55, -31.10)),
+    Region("Faial", "Açores", (38.49, -28.87, 38.67, -28.58)),
+    Region("Pico", "Açores", (38.36, -28.57, 38.56, -28.00)),
+    Region("São Jorge", "Açores", (38.53, -28.34, 38.78, -27.73)),
+    Region("Graciosa", "Açores", (38.98, -28.10, 39.12, -27.92)),
+    Region("Terceira", "Açores", (38.61, -27.41, 38.83, -27.01)),
+    Region("São Miguel", "Açores", (37.67, -25.88, 37.94, -25.10)),
+    Region("Santa Maria", "Açores", (36.90, -25.21, 37.04, -24.98)),
+    Region("Madeira", "Madeira", (32.61, -17.29, 32.90, -16.63)),
+    Region("Porto Santo", "Madeira", (33.01, -16.44, 33.12, -16.25)),
+    Region("Desertas", "Madeira", (32.38, -16.58, 32.57, -16.43)),
+    Region("Selvagens", "Madeira", (29.98, -16.07, 30.19, -15.83)),
+    _outlined_region("Açores", "Açores", [ACORES_OUTLINE]),
+    _outlined_region("Madeira", "Madeira", [MADEIRA_OUTLINE]),
+    _outlined_region("Portugal continental", "Portugal", [MAINLAND_OUTLINE]),
+)
+
+
+def _load_regions_file(path):
+    """Regions from a GeoJSON FeatureCollection, or () if the file doesn't exist."""
+    try:
+        collection = json.loads(Path(path).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return ()
+    regions = []
+    for feature in collection.get("features", []):
+        geometry = feature.get("geometry") or {}
+        polygons = {"Polygon": [geometry.get("coordinates")],
+                    "MultiPolygon": geometry.get("coordinates")}.get(geometry.get("type"))
+        properties = feature.get("properties") or {}
+        if not polygons or properties.get("territory") not in TERRITORIES:
+            logger.warning(f"Skipping region {properties.get('name')!r} in {path}: needs a territory and a (Multi)Polygon")
+            continue
+        rings = [[(float(lon), float(lat)) for lon, lat, *_ in ring] for polygon in polygons for ring in polygon]
+        regions.append(_outlined_region(properties.get("name"), properties["territory"], rings))
+    return tuple(regions)
+
+
+@lru_cache(maxsize=None)
+def _region_index(regions_file=REGIONS_FILE):
+    """
+    (regions, boxes, edges): the file's regions ahead of BUILTIN_REGIONS, their
+    boxes as an R×4 array and, per region, an E×4 array of (x1, y1, x2, y2)
+    outline edges or None.
+    """
+    regions = _load_regions_file(regions_file) + BUILTIN_REGIONS
+    boxes = np.array([region.bbox for region in regions], dtype=float)
+    edges = []
+    for region in regions:
+        if not region.rings:
+            edges.append(None)
+            continue
+        edges.append(np.concatenate([
+            np.hstack([ring[:-1], ring[1:]])
+            for ring in (np.asarray(ring, dtype=float) for ring in region.rings) if len(ring) > 1
+        ]))
+    return regions, boxes, edges
+
+
+def _inside_rings(x, y, edges):
+    """Even-odd point-in-polygon for points (x, y) against all edges at once."""
+    x1, y1, x2, y2 = (edges[:, i] for i in range(4))
+    crosses = (y1 > y[:, None]) != (y2 > y[:, None])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_cross = x1 + (y[:, None] - y1) * (x2 - x1) / (y2 - y1)
+    return (np.count_nonzero(crosses & (x[:, None] < x_cross), axis=1) % 2) == 1
+
+
+def locate_coordinates(coordinates, regions_file=REGIONS_FILE):
+    """
+    The first Region containing each (lat, lon), or None for unknown or
+    missing coordinates. All points are tested against every box in one
+    pass; outlines are only checked for points inside their box.
+    """
+    regions, boxes, edges = _region_index(regions_file)
+    points = np.array([c if c else (np.nan, np.nan) for c in coordinates], dtype=float).reshape(-1, 2)
+    lat, lon = points[:, :1], points[:, 1:]
+    # NaN compares False, so stations without coordinates match nothing
+    inside = (lat >= boxes[:, 0]) & (lon >= boxes[:, 1]) & (lat <= boxes[:, 2]) & (lon <= boxes[:, 3])
+    for r, region_edges in enumerate(edges):
+        if region_edges is None:
+            continue
+        rows = np.flatnonzero(inside[:, r])
+        if rows.size:
+            inside[rows, r] = _inside_rings(lon[rows, 0], lat[rows, 0], region_edges)
+    first = inside.argmax(axis=1)
+    return [regions[r] if found else None for r, found in zip(first, inside.any(axis=1))]
+
+
+def station_territories(station_ids, station_meta, source=TERRITORY_SOURCE, quiet=False):
+    """
+    {stationId: (territory, region name)} for station_ids, from coordinates
+    with the API's place as fallback; (None, None) when neither is known.
+    With quiet set, nothing is counted in METRICS.
+    """
+    station_ids = [str(i) for i in station_ids]
+    infos = [station_meta.get(i) or {} for i in station_ids]
+    if source == "coordinates":
+        located = locate_coordinates([_station_coordinates(info) for info in infos])
     else:
-        region = info.place.values[0]
-        territory.append(region)
+        located = [None] * len(infos)
+
+    territories = {}
+    for station_id, info, region in zip(station_ids, infos, located):
+        if region is not None:
+            territories[station_id] = (region.territory, region.name)
+        else:
+            territories[station_id] = (info.get("place") or None, None)
+    if not quiet:
+        METRICS.count("territories_located", sum(region is not None for region in located), source="coordinates")
+    return territories
 
-# Create new column called "territory" using the list generated above 
-ipma_data_yesterday['territory'] = territory
 
-# Filter out unknown territories before creating specific dataframes
-ipma_data_yesterday = ipma_data_yesterday[ipma_data_yesterday.territory != "Unknown"]
+def classify_territories(ipma_data_yesterday, station_meta, quiet=False):
+    """
+    Add the "territory" and "region" columns (see station_territories),
+    dropping stations without a territory. With quiet set (tables other than
+    the report day's), dropped stations are neither logged nor counted.
+    """
+    located = station_territories(ipma_data_yesterday['stationId'], station_meta, quiet=quiet)
 
-# Create dataframe for Madeira's values from yesterday 
-df_madeira_yesterday = ipma_data_yesterday[ipma_data_yesterday.territory == "Madeira"]
+    # Create empty lists for territory and region
+    territory = []
+    region = []
 
-# Create dataframe for Azores's values from yesterday 
-df_azores_yesterday = ipma_data_yesterday[ipma_data_yesterday.territory == "Açores"]
+    # Get territory for each station on the Dataframe 
+    for station_id in ipma_data_yesterday['stationId']:
+        place, region_name = located[str(station_id)]
+        if place is None:
+            if not quiet:
+                logger.warning(f"Could not get info for station {station_id}, skipping...")
+            territory.append("Unknown")  # Add placeholder instead of skipping
+        else:
+            territory.append(place)
+        region.append(region_name)
 
-# Create dataframe for Portugal's values from yesterday 
-df_portugal_yesterday = ipma_data_yesterday[ipma_data_yesterday.territory == "Portugal"]
+    # Create new columns called "territory" and "region" using the lists generated above
+    ipma_data_yesterday = ipma_data_yesterday.assign(territory=territory, region=region)
+
+    # Filter out unknown territories before ranking
+    known = ipma_data_yesterday.territory != "Unknown"
+    if not quiet:
+        METRICS.count("stations_dropped", int((~known).sum()), reason="unknown_territory")
+    return ipma_data_yesterday[known]
 
 
 # -----------------------------------
@@ -326,91 +1751,206 @@ df_portugal_yesterday = ipma_data_yesterday[ipma_data_yesterday.territory == "Po
 #       FOR ALL TERRITORIES
 # -----------------------------------
 
-# Max Temperatures 
-# Create Dataframe based on yesterday's data, sorting maximum temperature and extracting top 4 values
-
-four_temp_max_mad = df_madeira_yesterday.sort_values(by=['temp_max'],ascending=False).head(4)
-four_temp_max_az = df_azores_yesterday.sort_values(by=['temp_max'],ascending=False).head(4)
-four_temp_max_pt = df_portugal_yesterday.sort_values(by=['temp_max'],ascending=False).head(4)
-
-# Min Temperatures
-# Create Dataframes based on yesterday's data, sorting by minimum temperature
-
-four_temp_min_mad  = df_madeira_yesterday.sort_values(by=['temp_min'],ascending=True)
-four_temp_min_az = df_azores_yesterday.sort_values(by=['temp_min'],ascending=True)
-four_temp_min_pt = df_portugal_yesterday.sort_values(by=['temp_min'],ascending=True)
-# Drop all -99.0 values, since those are IPMA's way of saying station is fucked up or not working or somehting
-# (Yes!Really!)
-# and keep top four results
-four_temp_min_mad = four_temp_min_mad[four_temp_min_mad.temp_min != -99.0].head(4)
-four_temp_min_az = four_temp_min_az[four_temp_min_az.temp_min != -99.0].head(4)
-four_temp_min_pt = four_temp_min_pt[four_temp_min_pt.temp_min != -99.0].head(4)
-
-# Max Wind Gust 
-# Create Dataframes based on yesterday's data, sorting by maximum wind gust
-four_wind_max_mad = df_madeira_yesterday.sort_values(by=['vento_int_max_inst'],ascending=False).head(4)
-four_wind_max_az = df_azores_yesterday.sort_values(by=['vento_int_max_inst'],ascending=False).head(4)
-four_wind_max_pt = df_portugal_yesterday.sort_values(by=['vento_int_max_inst'],ascending=False).head(4)
-
-# Max rain accumulated
-# Create Dataframes based on yesterday's data, sorting by maximum accumulated rain
-four_rain_accu_mad = df_madeira_yesterday.sort_values(by=['prec_quant'],ascending=False).head(4)
-four_rain_accu_az = df_azores_yesterday.sort_values(by=['prec_quant'],ascending=False).head(4)
-four_rain_accu_pt = df_portugal_yesterday.sort_values(by=['prec_quant'],ascending=False).head(4)
-
-# Humidity Min 
-four_hum_min_mad  = df_madeira_yesterday.sort_values(by=['hum_min'],ascending=True)
-four_hum_min_az = df_azores_yesterday.sort_values(by=['hum_min'],ascending=True)
-four_hum_min_pt = df_portugal_yesterday.sort_values(by=['hum_min'],ascending=True)
-
-four_hum_min_mad = four_hum_min_mad[four_hum_min_mad.hum_min != -99.0].head(4)
-four_hum_min_az = four_hum_min_az[four_hum_min_az.hum_min != -99.0].head(4)
-four_hum_min_pt = four_hum_min_pt[four_hum_min_pt.hum_min != -99.0].head(4)
-
-# Humidity Max
-four_hum_max_mad  = df_madeira_yesterday.sort_values(by=['hum_max'],ascending=False)
-four_hum_max_az = df_azores_yesterday.sort_values(by=['hum_max'],ascending=False)
-four_hum_max_pt = df_portugal_yesterday.sort_values(by=['hum_max'],ascending=False)
-
-four_hum_max_mad = four_hum_max_mad[four_hum_max_mad.hum_max != -99.0].head(4)
-four_hum_max_az = four_hum_max_az[four_hum_max_az.hum_max != -99.0].head(4)
-four_hum_max_pt = four_hum_max_pt[four_hum_max_pt.hum_max != -99.0].head(4)
+TERRITORIES = ("Portugal", "Açores", "Madeira")
 
+# What each panel ranks: column, whether higher is better, and how many rows
+RankMetric = namedtuple("RankMetric", ["column", "descending", "k"])
 
-# ----------------------------------
-#       THERMAL AMPLITUDES
-# -----------------------------------
+RANK_METRICS = {
+    "temp_max": RankMetric("temp_max", True, 4),
+    "temp_min": RankMetric("temp_min", False, 4),
+    "wind_max": RankMetric("vento_int_max_inst", True, 4),
+    "rain_accu": RankMetric("prec_quant", True, 4),
+    "hum_min": RankMetric("hum_min", False, 4),
+    "hum_max": RankMetric("hum_max", True, 4),
+    "amplitude": RankMetric("amplitude", True, 1),
+}
+
+
+def _top_k_positions(values, k, descending):
+    """
+    Positions of the k best values, best first. NaN entries must already be
+    removed. Ties are broken by position, so the earlier station wins.
+    """
+    keys = -values if descending else values
+    if len(keys) > k:
+        # Partial selection: everything at least as good as the k-th best
+        kth = np.partition(keys, k - 1)[k - 1]
+        candidates = np.flatnonzero(keys <= kth)
+    else:
+        candidates = np.arange(len(keys))
+    order = np.lexsort((candidates, keys[candidates]))
+    return candidates[order][:k]
+
+
+def rank_stations(df, territories=TERRITORIES, metrics=RANK_METRICS, territory_col="territory"):
+    """
+    Rank the day's station table once for every (territory, metric) pair.
+    IPMA's -99.0 readings are masked out before selection, and the derived
+    'amplitude' column (temp_max - temp_min) is added when both are valid.
+    Returns {(territory, metric_name): DataFrame with the top-k rows, best first};
+    territories without stations get empty tables.
+    """
+    df = df.copy()
+    temp_max = df["temp_max"].to_numpy(dtype=float)
+    temp_min = df["temp_min"].to_numpy(dtype=float)
+    df["amplitude"] = np.where((temp_max != -99.0) & (temp_min != -99.0), temp_max - temp_min, np.nan)
+
+    columns = {}
+    for metric in metrics.values():
+        if metric.column not in columns:
+            values = df[metric.column].to_numpy(dtype=float)
+            columns[metric.column] = np.where(values == -99.0, np.nan, values)
+
+    groups = df.groupby(territory_col, sort=False).indices
+    rankings = {}
+    for territory in territories:
+        positions = groups.get(territory, np.array([], dtype=np.intp))
+        for name, metric in metrics.items():
+            values = columns[metric.column][positions]
+            valid = positions[~np.isnan(values)]
+            best = _top_k_positions(columns[metric.column][valid], metric.k, metric.descending)
+            rankings[territory, name] = df.iloc[valid[best]].copy()
+    return rankings
+
+
+# ------------------------------------
+#   LIGHTWEIGHT (PANDAS-FREE) ENGINE
+# ------------------------------------
+
+# PIPELINE_ENGINE=light builds, splits and ranks the day's stations as plain
+# records instead of DataFrames, so pandas is never imported. Rankings, and
+# therefore the images, are the same as with the pandas engine.
+PIPELINE_ENGINE = os.environ.get("PIPELINE_ENGINE", "pandas")
+
+STATION_COLUMNS = ("temp_max", "temp_min", "vento_int_max_inst", "prec_quant", "hum_max", "hum_min")
+
+
+class StationDay:
+    """One station's daily values. record["column"] works like a DataFrame row dict."""
+
+    __slots__ = ("date", "stationId", "territory", "region", "amplitude") + STATION_COLUMNS
 
-# Create a copy of the dataframes
-df_amplitude_pt = df_portugal_yesterday
-df_amplitude_az = df_azores_yesterday
-df_amplitude_mad = df_madeira_yesterday
+    def __init__(self, date, station_id, values):
+        self.date = date
+        self.stationId = station_id
+        self.territory = None
+        self.region = None
+        self.amplitude = math.nan
+        for column in STATION_COLUMNS:
+            setattr(self, column, values.get(column, math.nan))
 
-# Drop -99 values from all dataframes
-df_amplitude_pt=df_amplitude_pt[df_amplitude_pt.temp_min != -99.0]
-df_amplitude_pt=df_amplitude_pt[df_amplitude_pt.temp_max != -99.0]
-df_amplitude_az=df_amplitude_az[df_amplitude_az.temp_min != -99.0]
-df_amplitude_az=df_amplitude_az[df_amplitude_az.temp_max != -99.0]
-df_amplitude_mad=df_amplitude_mad[df_amplitude_mad.temp_min != -99.0]
-df_amplitude_mad=df_amplitude_mad[df_amplitude_mad.temp_max != -99.0]
+    def __getitem__(self, column):
+        return getattr(self, column)
 
+    def __repr__(self):
+        return f"StationDay({self.date!r}, {self.stationId!r}, territory={self.territory!r})"
 
-# Create Amplitude Column for each dataframe
-df_amplitude_pt['amplitude']=df_amplitude_pt.temp_max - df_amplitude_pt.temp_min
-df_amplitude_az['amplitude']=df_amplitude_az.temp_max - df_amplitude_az.temp_min
-df_amplitude_mad['amplitude']=df_amplitude_mad.temp_max - df_amplitude_mad.temp_min
 
-# Sort Dataframe by amplitude and filter forthe the top record
-df_amplitude_pt = df_amplitude_pt.sort_values(by=['amplitude'],ascending=False).head(1)
-df_amplitude_az = df_amplitude_az.sort_values(by=['amplitude'],ascending=False).head(1)
-df_amplitude_mad = df_amplitude_mad.sort_values(by=['amplitude'],ascending=False).head(1)
+def _number_type(stations):
+    """
+    The type the DataFrame would give every reading: int if all are ints,
+    float once any is a float or missing, None (as is) if any isn't a number.
+    """
+    all_ints = True
+    for obs in stations.values():
+        if any(column not in obs for column in STATION_COLUMNS):
+            all_ints = False
+        for value in obs.values():
+            if value is None or isinstance(value, float):
+                all_ints = False
+            elif not isinstance(value, int) or isinstance(value, bool):
+                return None
+    return int if all_ints else float
+
+
+def build_station_records(json_data, yesterday_date):
+    """build_station_table for the light engine: a list of StationDay (no check.csv)."""
+    if yesterday_date not in json_data:
+        raise RuntimeError(f"No observations available for {yesterday_date}")
+
+    stations = json_data[yesterday_date]
+    cast = _number_type(stations)
+    records = []
+    for station_id, obs in stations.items():
+        if cast is float:
+            obs = {column: math.nan if value is None else float(value) for column, value in obs.items()}
+        records.append(StationDay(yesterday_date, station_id, obs))
+    return records
+
+
+def classify_station_records(records, station_meta, quiet=False):
+    """classify_territories for the light engine."""
+    located = station_territories([record.stationId for record in records], station_meta, quiet=quiet)
+    known = []
+    for record in records:
+        record.territory, record.region = located[str(record.stationId)]
+        if record.territory is None:
+            if not quiet:
+                logger.warning(f"Could not get info for station {record.stationId}, skipping...")
+            continue
+        known.append(record)
+    if not quiet:
+        METRICS.count("stations_dropped", len(records) - len(known), reason="unknown_territory")
+    return known
+
+
+def _rank_value(value):
+    value = math.nan if value is None else float(value)
+    return math.nan if value == -99.0 else value
+
+
+def rank_station_records(records, territories=TERRITORIES, metrics=RANK_METRICS):
+    """
+    rank_stations for the light engine: {(territory, metric_name): [StationDay, ...]},
+    best first, with the same masking and tie-breaking (earlier station wins).
+    """
+    by_territory = {}
+    for record in records:
+        temp_max, temp_min = _rank_value(record.temp_max), _rank_value(record.temp_min)
+        record.amplitude = temp_max - temp_min
+        by_territory.setdefault(record.territory, []).append(record)
+
+    rankings = {}
+    for territory in territories:
+        group = by_territory.get(territory, [])
+        for name, metric in metrics.items():
+            scored = []
+            for position, record in enumerate(group):
+                value = _rank_value(record[metric.column])
+                if not math.isnan(value):
+                    scored.append((-value if metric.descending else value, position, record))
+            rankings[territory, name] = [record for _, _, record in heapq.nsmallest(metric.k, scored)]
+    return rankings
+
+
+def _table_station_ids(table):
+    return table['stationId'].astype(str).tolist()
+
+
+def _record_station_ids(records):
+    return [str(record.stationId) for record in records]
+
+
+# The day's table stages, per engine
+Engine = namedtuple("Engine", ["build_table", "station_ids", "classify", "rank"])
+
+ENGINES = {
+    "pandas": Engine(build_station_table, _table_station_ids, classify_territories, rank_stations),
+    "light": Engine(build_station_records, _record_station_ids, classify_station_records, rank_station_records),
+}
+
+
+def _ranked_records(rows):
+    """Ranked rows from either engine as a list of row mappings."""
+    return rows.to_dict("records") if hasattr(rows, "to_dict") else rows
 
 
 # ----------------------------------
-#       ADDING COLORS TO DATAFRAMES
+#       REPORT LAYOUT
 # -----------------------------------
 
-# Create Colors Lists 
+# Colors Lists, one per row of a ranked panel
 
 colors_temp_max = [(154,7,7),(144,37,37),(134,67,67),(124,97,97)]
 colors_temp_min = [(89,165,222),(89,165,222),(107,176,226),(141,195,233)]
@@ -419,523 +1959,910 @@ colors_hum_min = [(154,7,7),(234,9,9),(240,157,57),(239,129,129)]
 colors_wind_max = [(89,133,187),(122,160,210),(147,179,224),(189,208,234)]
 colors_rain_max = [(112,121,164),(138,147,189),(163,175,213),(185,194,226)]
 
-# Attach colors, tolerating regions/metrics with fewer than the expected
-# number of valid stations (e.g. after IPMA's -99.0 invalid readings are
-# filtered out), so a sparse day degrades gracefully instead of crashing.
-def add_colors(df, colors):
-    if len(df) < len(colors):
-        logger.warning(
-            "Only %d station(s) available where %d were expected; rendering available data.",
-            len(df), len(colors),
-        )
-    df.loc[:,'colors'] = pd.Series(colors[:len(df)]).values
-    return df
+# Font file needs to be in the same folder
+FONT_FILE = 'Lato-Bold.ttf'
+
+# One piece of text in a panel row. source is "name" (station location) or a
+# column of the ranked rows; xy is relative to the row origin; color None
+# takes the panel's colour ramp for that row.
+Field = namedtuple("Field", ["source", "xy", "font_size", "color", "fmt", "strip_name"],
+                   defaults=(None, str, True))
+
+def _round2(value):
+    return str(round(value, 2))
+
+
+# A ranked panel: rows start at origin and move down by pitch pixels
+Panel = namedtuple("Panel", ["metric", "origin", "pitch", "fields", "colors"], defaults=(None,))
+
+# Left column: station name at x=115, value at x=460
+# Right column: station name at x=650, value at x=950
+REPORT_PANELS = (
+    Panel("temp_max", (0, 190), 30, (Field("name", (115, 0), 22), Field("temp_max", (460, 0), 22)), colors_temp_max),
+    Panel("temp_min", (0, 370), 30, (Field("name", (115, 0), 22), Field("temp_min", (460, 0), 22)), colors_temp_min),
+    Panel("rain_accu", (0, 540), 30, (Field("name", (115, 0), 22), Field("prec_quant", (460, 0), 22)), colors_rain_max),
+    Panel("wind_max", (0, 720), 30, (Field("name", (115, 0), 22), Field("vento_int_max_inst", (460, 0), 22)), colors_wind_max),
+    Panel("hum_max", (0, 190), 30, (Field("name", (650, 0), 22), Field("hum_max", (950, 0), 22)), colors_hum_max),
+    Panel("hum_min", (0, 370), 30, (Field("name", (650, 0), 22), Field("hum_min", (950, 0), 22)), colors_hum_min),
+    Panel("amplitude", (0, 0), 0, (
+        Field("name", (842, 525), 14, (0,0,0), strip_name=False),
+        Field("temp_max", (920, 570), 22, (154,7,7)),
+        Field("temp_min", (683, 570), 22, (93,173,236)),
+        Field("amplitude", (755, 600), 72, (250,186,61), fmt=_round2),
+    )),
+)
+
+# Report date, bottom left
+DATE_FIELD = Field("date", (29, 1020), 24, (255,255,255))
+
+# Per territory: base template, output file and the suffix/prefix stripped from station names
+TerritoryLayout = namedtuple("TerritoryLayout", ["template", "output", "strip", "panels"], defaults=(REPORT_PANELS,))
+
+TERRITORY_LAYOUTS = {
+    "Portugal": TerritoryLayout("resumo_meteo_template_pt.png", "daily_meteo_report_pt.png", "(CIM)"),
+    "Açores": TerritoryLayout("resumo_meteo_template_az.png", "daily_meteo_report_az.png", "(DROTRH)"),
+    "Madeira": TerritoryLayout("resumo_meteo_template_mad.png", "daily_meteo_report_mad.png", "Madeira,"),
+}
+
+# ----------------------------------
+#       RENDER ASSET CACHE
+# -----------------------------------
+
+# Templates are decoded from PNG once and kept as raw pixels under
+# TEMPLATE_CACHE_DIR, keyed by the PNG's content hash, so later renders
+# memory-map them instead of inflating the PNG again.
+TEMPLATE_CACHE_DIR = Path("cache") / "templates"
+
+_templates = {}  # {(path, mtime_ns, size): Image}, per process
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _asset_digest(path, mtime_ns, size):
+    return _file_digest(path)
+
+
+def asset_digest(path):
+    """Content hash of a template or font file, computed once per file version."""
+    stat = os.stat(path)
+    return _asset_digest(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+def load_template(path):
+    """
+    Return the decoded template image for path. The image is backed by a
+    read-only memory map of the raw cache file, so callers must copy() it
+    before drawing.
+    """
+    stat = os.stat(path)
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    if key in _templates:
+        return _templates[key]
+
+    digest = _file_digest(path)[:16]
+    cached = sorted(TEMPLATE_CACHE_DIR.glob(f"{Path(path).stem}-{digest}-*.raw"))
+    if not cached:
+        with Image.open(path) as source:
+            # Palette images can't be restored from raw pixels alone
+            source = source.convert("RGBA") if source.mode not in ("RGBA", "RGB", "L") else source
+            raw = TEMPLATE_CACHE_DIR / f"{Path(path).stem}-{digest}-{source.mode}-{source.width}x{source.height}.raw"
+            TEMPLATE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            tmp = raw.with_suffix(".tmp")
+            tmp.write_bytes(source.tobytes())
+            tmp.replace(raw)
+        logger.info(f"Cached decoded template {path} as {raw}")
+        METRICS.count("cache_misses", cache="templates")
+        cached = [raw]
+    else:
+        METRICS.count("cache_hits", cache="templates")
+
+    # File name: <stem>-<digest>-<mode>-<width>x<height>.raw
+    mode, size = cached[0].stem.split("-")[-2:]
+    width, height = (int(v) for v in size.split("x"))
+    with open(cached[0], "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    image = Image.frombuffer(mode, (width, height), mapped, "raw", mode, 0, 1)
+    _templates[key] = image
+    return image
+
+
+@lru_cache(maxsize=None)
+def get_font(size):
+    """Process-wide registry: one parsed font face per size."""
+    return ImageFont.truetype(FONT_FILE, size)
+
 
+# Rasterised text runs kept per process; values, dates and station names
+# repeat across territories and (in backfills) across days
+GLYPH_CACHE_SIZE = int(os.environ.get("GLYPH_CACHE_SIZE", "4096"))
 
-# Max Temperature Colors
 
-four_temp_max_mad = add_colors(four_temp_max_mad, colors_temp_max)
-four_temp_max_az = add_colors(four_temp_max_az, colors_temp_max)
-four_temp_max_pt = add_colors(four_temp_max_pt, colors_temp_max)
+@lru_cache(maxsize=GLYPH_CACHE_SIZE)
+def glyph_run(font_size, text):
+    """
+    Coverage mask ("L" tile) of text in FONT_FILE at font_size, and its
+    offset from the draw position. Colour is applied when compositing, so
+    one tile serves every colour the string is drawn in.
+    """
+    font = get_font(font_size)
+    left, top, right, bottom = font.getbbox(text)
+    tile = Image.new("L", (right - left, bottom - top), 0)
+    ImageDraw.Draw(tile).text((-left, -top), text, 255, font=font)
+    return tile, (left, top)
+
 
-# Min Temperature Colors
+# A field resolved to absolute coordinates and a fixed colour
+DrawOp = namedtuple("DrawOp", ["source", "xy", "font_size", "color", "fmt", "strip_name"])
 
-four_temp_min_mad = add_colors(four_temp_min_mad, colors_temp_min)
-four_temp_min_az = add_colors(four_temp_min_az, colors_temp_min)
-four_temp_min_pt = add_colors(four_temp_min_pt, colors_temp_min)
+# One string to draw; a territory's report is its template plus a list of these
+TextOp = namedtuple("TextOp", ["xy", "text", "color", "font_size"])
 
 
-# Max Rainfall 
+@lru_cache(maxsize=None)
+def compile_layout(territory):
+    """
+    Resolve a territory's layout once into absolute draw operations:
+    {metric: [ops for row 0, ops for row 1, ...]}, plus the date op under None.
+    """
+    layout = TERRITORY_LAYOUTS[territory]
+
+    def op(field, origin, color):
+        xy = (origin[0] + field.xy[0], origin[1] + field.xy[1])
+        return DrawOp(field.source, xy, field.font_size, field.color or color, field.fmt, field.strip_name)
 
-four_rain_accu_mad = add_colors(four_rain_accu_mad, colors_rain_max)
-four_rain_accu_az = add_colors(four_rain_accu_az, colors_rain_max)
-four_rain_accu_pt = add_colors(four_rain_accu_pt, colors_rain_max)
+    compiled = {}
+    for panel in layout.panels:
+        rows = []
+        for r in range(RANK_METRICS[panel.metric].k):
+            origin = (panel.origin[0], panel.origin[1] + r * panel.pitch)
+            color = panel.colors[r] if panel.colors else None
+            rows.append([op(field, origin, color) for field in panel.fields])
+        compiled[panel.metric] = rows
+    compiled[None] = [[op(DATE_FIELD, (0, 0), None)]]
+    return compiled
 
 
-# Max Wind Gust 
+def resolve_report(territory, rankings, station_meta, report_date):
+    """
+    Resolve one territory's ranked rows and station names into the exact
+    strings, positions, colours and font sizes that will be drawn.
+    """
+    layout = TERRITORY_LAYOUTS[territory]
+    compiled = compile_layout(territory)
+    ops = []
+
+    for metric, row_ops in compiled.items():
+        if metric is None:
+            ops.extend(TextOp(draw_op.xy, report_date, draw_op.color, draw_op.font_size) for draw_op in row_ops[0])
+            continue
+
+        ranked = rankings[territory, metric]
+        # Tolerate regions/metrics with fewer than the expected number of valid
+        # stations, so a sparse day degrades gracefully instead of crashing.
+        if len(ranked) < len(row_ops):
+            logger.warning(
+                "Only %d station(s) available where %d were expected; rendering available data.",
+                len(ranked), len(row_ops),
+            )
+        for record, row in zip(_ranked_records(ranked), row_ops):
+            for draw_op in row:
+                if draw_op.source == "name":
+                    text = station_meta[str(record["stationId"])]["location"]
+                    if draw_op.strip_name:
+                        text = text.replace(layout.strip, "").strip()
+                else:
+                    text = draw_op.fmt(record[draw_op.source])
+                ops.append(TextOp(draw_op.xy, text, draw_op.color, draw_op.font_size))
+
+    return ops
+
+
+def composite_text(image, ops):
+    """
+    Paint TextOps onto image from cached glyph runs. Filling the colour
+    through the coverage mask blends exactly like ImageDraw.text does.
+    """
+    for op in ops:
+        if "\n" in op.text:
+            # Multi-line layout is left to ImageDraw
+            ImageDraw.Draw(image).text(op.xy, op.text, op.color, font=get_font(op.font_size))
+            continue
+        tile, (left, top) = glyph_run(op.font_size, op.text)
+        if tile.width and tile.height:
+            image.paste(op.color, (op.xy[0] + left, op.xy[1] + top), tile)
 
-four_wind_max_mad = add_colors(four_wind_max_mad, colors_wind_max)
-four_wind_max_az = add_colors(four_wind_max_az, colors_wind_max)
-four_wind_max_pt = add_colors(four_wind_max_pt, colors_wind_max)
 
-# Mazimum Humidity
+def draw_report(territory, ops):
+    """Draw resolved TextOps onto a copy of the territory's template."""
+    image = load_template(TERRITORY_LAYOUTS[territory].template).copy()
+    composite_text(image, ops)
+    return image
 
-four_hum_max_mad = add_colors(four_hum_max_mad, colors_hum_max)
-four_hum_max_az = add_colors(four_hum_max_az, colors_hum_max)
-four_hum_max_pt = add_colors(four_hum_max_pt, colors_hum_max)
 
-# Min Humidity
-four_hum_min_mad = add_colors(four_hum_min_mad, colors_hum_min)
-four_hum_min_az = add_colors(four_hum_min_az, colors_hum_min)
-four_hum_min_pt = add_colors(four_hum_min_pt, colors_hum_min)
+def render_report(territory, rankings, station_meta, report_date):
+    """
+    Draw one territory's report from ranked rows and already resolved station
+    names. Returns the edited template image; makes no network calls.
+    """
+    return draw_report(territory, resolve_report(territory, rankings, station_meta, report_date))
 
 
 # ------------------------------
 #       IMAGE MANIPULATION 
 # ------------------------------
 
+# PNG encoder settings; trade output size against CPU time.
+# PNG_OPTIMIZE=1 implies maximum compression. PNG_QUANTIZE_COLORS=N (e.g. 256)
+# converts the report to an N colour palette before encoding, 0 keeps RGBA.
+PngEncoder = namedtuple("PngEncoder", ["compress_level", "optimize", "quantize_colors"])
+
+PNG_ENCODER = PngEncoder(
+    compress_level=int(os.environ.get("PNG_COMPRESS_LEVEL", "6")),
+    optimize=os.environ.get("PNG_OPTIMIZE", "0") == "1",
+    quantize_colors=int(os.environ.get("PNG_QUANTIZE_COLORS", "0")),
+)
+
+# Territory images are drawn and encoded in separate processes; 1 renders inline
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", str(os.cpu_count() or 1)))
+
+# Each PNG carries a hash of everything it was rendered from (text, positions,
+# colours, template, font, encoder). A territory whose existing output has the
+# same hash is neither drawn nor encoded, so re-runs leave it byte-identical.
+# RENDER_SKIP_UNCHANGED=0 always redraws.
+RENDER_SKIP_UNCHANGED = os.environ.get("RENDER_SKIP_UNCHANGED", "1") == "1"
+RENDER_HASH_KEY = "render-hash"
+
+# Extra files encoded from the in-memory report next to each PNG: file name
+# suffix, Pillow format, longest side in pixels (None keeps full size) and
+# encoder options. JPEGs drop the alpha channel.
+Derivative = namedtuple("Derivative", ["suffix", "format", "max_size", "options"])
+
+DERIVATIVES = {
+    "webp": Derivative(".webp", "WEBP", None, {"quality": 90, "method": 4}),
+    "jpeg": Derivative(".jpg", "JPEG", None, {"quality": 90, "optimize": True}),
+    "png_720": Derivative("_720.png", "PNG", 720, {"compress_level": 6}),
+    "thumb": Derivative("_thumb.jpg", "JPEG", 256, {"quality": 85}),
+}
+# REPORT_DERIVATIVES=webp,thumb (or --derivatives webp thumb) picks which ones are written
+REPORT_DERIVATIVES = tuple(name for name in os.environ.get("REPORT_DERIVATIVES", "").split(",") if name)
+
+# Every file written for a report, with its size and encode time, per output directory
+REPORT_MANIFEST_FILE = "report_manifest.json"
+
+
+def save_png(image, path, encoder=PNG_ENCODER, text=None):
+    """Encode image to path with the given PngEncoder settings and optional tEXt entries."""
+    if encoder.quantize_colors:
+        image = image.quantize(colors=encoder.quantize_colors, method=Image.Quantize.FASTOCTREE)
+    pnginfo = None
+    if text:
+        pnginfo = PngImagePlugin.PngInfo()
+        for key, value in text.items():
+            pnginfo.add_text(key, value)
+    image.save(path, format="PNG", compress_level=encoder.compress_level, optimize=encoder.optimize, pnginfo=pnginfo)
+
+
+def derivative_path(output, name):
+    """Where the named derivative of the report at output is written."""
+    output = Path(output)
+    return str(output.with_name(output.stem + DERIVATIVES[name].suffix))
+
+
+def save_derivative(image, path, derivative):
+    """Encode a (possibly downscaled) copy of image to path as described by derivative."""
+    if derivative.max_size and max(image.size) > derivative.max_size:
+        scale = derivative.max_size / max(image.size)
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    if derivative.format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    image.save(path, format=derivative.format, **derivative.options)
+    return image.size
+
+
+def render_hash(territory, ops, encoder=PNG_ENCODER, derivatives=()):
+    """Content hash of a territory's fully resolved render inputs."""
+    inputs = {
+        "template": asset_digest(TERRITORY_LAYOUTS[territory].template),
+        "font": asset_digest(FONT_FILE),
+        "encoder": list(encoder),
+        "derivatives": [[name, *DERIVATIVES[name]] for name in derivatives],
+        "ops": ops,
+    }
+    return hashlib.sha256(json.dumps(inputs, ensure_ascii=False).encode("utf-8")).hexdigest()
 
-# Load Base Images
-template_pt = Image.open("resumo_meteo_template_pt.png")
-template_az = Image.open("resumo_meteo_template_az.png")
-template_mad = Image.open("resumo_meteo_template_mad.png")
 
-# Define Font and Size
-# Font file needs to be in the same folder
-title_font = ImageFont.truetype('Lato-Bold.ttf', 24)
-subtitle_font = ImageFont.truetype('Lato-Bold.ttf', 22)
-date_font = ImageFont.truetype('Lato-Bold.ttf', 24)
-amplitude_font =ImageFont.truetype('Lato-Bold.ttf',72)
-location_font =ImageFont.truetype('Lato-Bold.ttf',14)
+def _png_text(path, key):
+    """A tEXt value from a PNG's header chunks, read without decoding the image; None if absent."""
+    try:
+        with open(path, "rb") as f:
+            if f.read(8) != b"\x89PNG\r\n\x1a\n":
+                return None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return None
+                length, chunk_type = struct.unpack(">I4s", header)
+                # Pillow writes text chunks before the image data
+                if chunk_type == b"IDAT":
+                    return None
+                data = f.read(length)
+                f.seek(4, os.SEEK_CUR)  # CRC
+                if chunk_type == b"tEXt":
+                    name, _, value = data.partition(b"\0")
+                    if name == key.encode("latin-1"):
+                        return value.decode("latin-1")
+    except FileNotFoundError:
+        return None
 
-# Create copies of the images that can be edited
-image_editable_pt = ImageDraw.Draw(template_pt)
-image_editable_az = ImageDraw.Draw(template_az)
-image_editable_mad = ImageDraw.Draw(template_mad)
 
+def _render_and_save(territory, ops, output, digest, encoder, derivatives=()):
+    """
+    Process pool task: draw one territory, then encode the PNG and every
+    derivative from the same in-memory image on parallel threads.
+    Returns (manifest entries of the written files, draw seconds, save seconds).
+    """
+    start = time.perf_counter()
+    image = draw_report(territory, ops)
+    drawn = time.perf_counter()
+
+    def encode(name):
+        encode_start = time.perf_counter()
+        if name is None:
+            path, fmt = output, "PNG"
+            save_png(image, path, encoder, text={RENDER_HASH_KEY: digest})
+            size = image.size
+        else:
+            path, fmt = derivative_path(output, name), DERIVATIVES[name].format
+            # Image.save() keeps its options on the image object, so threads can't share one
+            size = save_derivative(image.copy(), path, DERIVATIVES[name])
+        return {"name": name or "png", "path": path, "format": fmt, "width": size[0], "height": size[1],
+                "bytes": os.path.getsize(path), "seconds": round(time.perf_counter() - encode_start, 6)}
+
+    # Pillow releases the GIL while encoding, so the formats encode concurrently
+    names = [None, *derivatives]
+    if len(names) == 1:
+        entries = [encode(None)]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(names)) as pool:
+            entries = list(pool.map(encode, names))
+    return entries, drawn - start, time.perf_counter() - drawn
 
-# Create vars for coordinates
 
-# Right Column 
+def _read_manifest(output_dir):
+    try:
+        return json.loads((Path(output_dir) / REPORT_MANIFEST_FILE).read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return {}
 
-max_temp_start_coords = 190 # This value increments by 30px every loop iteration
-max_temp_station_name_x = 115  # Where Station Name Appears 
-max_temp_value_x = 460  # Where Value Appears 
 
-min_temp_start_coords = 370 # This value increments by 30px every loop iteration
-min_temp_station_name_x = 115  # Where Station Name Appears 
-min_temp_value_x = 460  # Where Value Appears 
+def render_reports(rankings, station_meta, report_date, workers=RENDER_WORKERS, encoder=PNG_ENCODER, output_dir=".",
+                   skip_unchanged=RENDER_SKIP_UNCHANGED, derivatives=REPORT_DERIVATIVES):
+    """
+    Draw and save every territory's report (and its derivatives) into
+    output_dir, fanning territories out to a process pool. Each task only
+    receives its own resolved text. With skip_unchanged set, territories
+    whose PNG has a matching render hash and whose derivatives all exist are
+    left untouched. Writes REPORT_MANIFEST_FILE when anything was rendered.
+    """
+    outputs, tasks = [], []
+    for territory in TERRITORY_LAYOUTS:
+        ops = resolve_report(territory, rankings, station_meta, report_date)
+        output = str(Path(output_dir) / TERRITORY_LAYOUTS[territory].output)
+        digest = render_hash(territory, ops, encoder, derivatives)
+        outputs.append(output)
+        if (skip_unchanged and _png_text(output, RENDER_HASH_KEY) == digest
+                and all(os.path.exists(derivative_path(output, name)) for name in derivatives)):
+            logger.info(f"{output} is up to date, not redrawing it")
+            METRICS.count("renders_skipped", territory=territory)
+            continue
+        tasks.append((territory, ops, output, digest, encoder, derivatives))
 
-max_rain_start_coords = 540 # This value increments by 30px every loop iteration
-max_rain_station_name_x = 115  # Where Station Name Appears 
-max_rain_value_x = 460  # Where Value Appears 
+    if workers <= 1 or len(tasks) <= 1:
+        results = [_render_and_save(*task) for task in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            results = list(pool.map(_render_and_save, *zip(*tasks)))
+
+    if not tasks:
+        return outputs
+
+    previous = _read_manifest(output_dir).get("territories", {})
+    manifest = {territory: dict(previous[territory], skipped=True)
+                for territory in TERRITORY_LAYOUTS if territory in previous}
+    for (territory, _, output, digest, *_), (entries, draw_seconds, save_seconds) in zip(tasks, results):
+        logger.info(f"Saved {output} ({len(entries)} file(s)) in {draw_seconds + save_seconds:.2f}s")
+        METRICS.record(f"{territory}/draw", draw_seconds)
+        METRICS.record(f"{territory}/save", save_seconds)
+        for entry in entries:
+            METRICS.count("bytes_out", entry["bytes"], kind=entry["format"].lower())
+        manifest[territory] = {"render_hash": digest, "skipped": False, "draw_seconds": round(draw_seconds, 6),
+                               "save_seconds": round(save_seconds, 6), "files": entries}
+
+    manifest_file = Path(output_dir) / REPORT_MANIFEST_FILE
+    manifest_file.write_text(json.dumps({"report_date": report_date, "territories": manifest},
+                                        ensure_ascii=False, indent=1), encoding="utf-8")
+    return outputs
 
-max_wind_start_coords = 720 # This value increments by 30px every loop iteration
-max_wind_station_name_x = 115  # Where Station Name Appears 
-max_wind_value_x = 460  # Where Value Appears 
 
+# ------------------------------
+#        ROLLING EXTREMES
+# ------------------------------
 
-# Left Column 
+# Multi-day extremes per station (last 7 and 30 days, month and year to date),
+# updated from each report day's aggregates and never recomputed from history.
+# The last ROLLING_RING_DAYS daily values sit in a ring for the sliding
+# windows; month/year to date are running max/min/sum/count accumulators.
+# Everything is one compressed .npz that loads in a few milliseconds.
+ROLLING_FILE = Path("cache") / "rolling.npz"
+# Top stations per window and territory, written next to the reports
+ROLLING_SUMMARY_FILE = "rolling_extremes.json"
+# ROLLING_EXTREMES=0 leaves the rolling state alone
+ROLLING_EXTREMES = os.environ.get("ROLLING_EXTREMES", "1") == "1"
+ROLLING_RING_DAYS = 30
+
+ROLLING_STATS = ("max", "min", "sum", "count")
+# The statistic a window ranks each daily column by
+ROLLING_COLUMNS = {
+    "temp_max": "max",
+    "temp_min": "min",
+    "vento_int_max_inst": "max",
+    "prec_quant": "sum",
+    "hum_max": "max",
+    "hum_min": "min",
+}
+ROLLING_WINDOWS = ("7d", "30d", "mtd", "ytd")
 
-max_hum_start_coords = 190 # This value increments by 30px every loop iteration
-max_hum_station_name_x = 650  # WHere Station Name Appears 
-max_hum_value_x = 950  # Where Value Appears 
-max_hum_unit_x = 970    # Where Unit Appears 
 
-min_hum_start_coords = 370 # This value increments by 30px every loop iteration
-min_hum_station_name_x = 650  # WHere Station Name Appears 
-min_hum_value_x = 950  # Where Value Appears 
-min_hum_unit_x = 970    # Where Unit Appears 
+class RollingExtremes:
+    """
+    Rolling window state for all stations seen so far. Days must be added
+    in order; a day not newer than the last one is ignored, so re-runs never
+    count a day twice.
+    """
 
+    def __init__(self):
+        self.station_ids = []
+        self._index = {}
+        self.last_day = 0  # proleptic ordinal of the last day added, 0 when empty
+        self.ring_days = np.zeros(ROLLING_RING_DAYS, dtype=np.int64)
+        self.ring = np.full((ROLLING_RING_DAYS, 0, len(ROLLING_COLUMNS)), np.nan)
+        # Month and year to date: (period, stat, station, column)
+        self.totals = self._empty_totals(2, 0)
+
+    @staticmethod
+    def _empty_totals(periods, stations):
+        totals = np.empty((periods, len(ROLLING_STATS), stations, len(ROLLING_COLUMNS)))
+        totals[:, 0], totals[:, 1], totals[:, 2:] = -np.inf, np.inf, 0
+        return totals
+
+    @classmethod
+    def load(cls, path=ROLLING_FILE):
+        """The saved state, or an empty one if there is none."""
+        state = cls()
+        try:
+            with np.load(path, allow_pickle=False) as saved:
+                if list(saved["columns"]) != list(ROLLING_COLUMNS) or saved["ring"].shape[0] != ROLLING_RING_DAYS:
+                    logger.warning(f"Ignoring rolling state {path} saved with different settings")
+                    return state
+                state.station_ids = [str(i) for i in saved["station_ids"]]
+                state.last_day = int(saved["last_day"])
+                state.ring_days = saved["ring_days"]
+                state.ring = saved["ring"]
+                state.totals = saved["totals"]
+        except FileNotFoundError:
+            return state
+        state._index = {station_id: i for i, station_id in enumerate(state.station_ids)}
+        return state
+
+    def save(self, path=ROLLING_FILE):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp = Path(f"{path}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, station_ids=np.array(self.station_ids, dtype=str), columns=np.array(list(ROLLING_COLUMNS)),
+                                last_day=self.last_day, ring_days=self.ring_days, ring=self.ring, totals=self.totals)
+        tmp.replace(path)
+
+    def _add_stations(self, station_ids):
+        new = [station_id for station_id in station_ids if station_id not in self._index]
+        if not new:
+            return
+        for station_id in new:
+            self._index[station_id] = len(self.station_ids)
+            self.station_ids.append(station_id)
+        self.ring = np.concatenate([self.ring, np.full((ROLLING_RING_DAYS, len(new), len(ROLLING_COLUMNS)), np.nan)], axis=1)
+        self.totals = np.concatenate([self.totals, self._empty_totals(2, len(new))], axis=2)
+
+    def update(self, report_date, stations):
+        """
+        Add one day's {stationId: {column: value}} aggregates (-99.0 or a
+        missing column counts as no reading). Returns False if the day was
+        not newer than the last one added.
+        """
+        day = datetime.strptime(report_date, "%Y-%m-%d").date()
+        if day.toordinal() <= self.last_day:
+            return False
+        self._add_stations([str(station_id) for station_id in stations])
+
+        values = np.full((len(self.station_ids), len(ROLLING_COLUMNS)), np.nan)
+        for station_id, obs in stations.items():
+            row = values[self._index[str(station_id)]]
+            for c, column in enumerate(ROLLING_COLUMNS):
+                value = obs.get(column)
+                if value is not None and value != -99.0:
+                    row[c] = value
+
+        # Accumulators restart when the month / year changes
+        if self.last_day:
+            last = date.fromordinal(self.last_day)
+            if (last.year, last.month) != (day.year, day.month):
+                self.totals[0] = self._empty_totals(1, len(self.station_ids))[0]
+            if last.year != day.year:
+                self.totals[1] = self._empty_totals(1, len(self.station_ids))[0]
+
+        valid = ~np.isnan(values)
+        self.totals[:, 0] = np.fmax(self.totals[:, 0], values)
+        self.totals[:, 1] = np.fmin(self.totals[:, 1], values)
+        self.totals[:, 2] += np.where(valid, values, 0)
+        self.totals[:, 3] += valid
+
+        slot = day.toordinal() % ROLLING_RING_DAYS
+        self.ring[slot] = values
+        self.ring_days[slot] = day.toordinal()
+        self.last_day = day.toordinal()
+        return True
+
+    def window_start(self, window):
+        """First day (date) of window, ending at the last day added."""
+        last = date.fromordinal(self.last_day)
+        if window == "mtd":
+            return last.replace(day=1)
+        if window == "ytd":
+            return last.replace(month=1, day=1)
+        return last - timedelta(days=int(window.rstrip("d")) - 1)
+
+    def window(self, window):
+        """
+        (stat, station, column) array of max/min/sum/count over window;
+        max/min/sum are NaN for stations without a reading.
+        """
+        if window in ("mtd", "ytd"):
+            stats = self.totals[ROLLING_WINDOWS.index(window) - 2].copy()
+        else:
+            days = int(window.rstrip("d"))
+            if days > ROLLING_RING_DAYS:
+                raise ValueError(f"Window {window} is longer than the {ROLLING_RING_DAYS} days kept")
+            values = self.ring[self.ring_days > self.last_day - days]
+            valid = ~np.isnan(values)
+            with np.errstate(all="ignore"), warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN stations
+                stats = np.stack([np.nanmax(values, axis=0, initial=-np.inf), np.nanmin(values, axis=0, initial=np.inf),
+                                  np.where(valid, values, 0).sum(axis=0), valid.sum(axis=0)])
+        stats[:3, stats[3] == 0] = np.nan
+        return stats
+
+    def window_aggregates(self, window):
+        """
+        The window as one day of json_data ({stationId: {column: value}}),
+        each column reduced by its ROLLING_COLUMNS statistic, so the
+        engines can classify and rank it like a report day.
+        """
+        stats = self.window(window)
+        picked = np.stack([stats[ROLLING_STATS.index(stat), :, c] for c, stat in enumerate(ROLLING_COLUMNS.values())], axis=1)
+        # Sums of one-decimal readings pick up float noise
+        picked = np.round(picked, 6)
+        return {
+            station_id: {column: (-99.0 if math.isnan(value) else float(value)) for column, value in zip(ROLLING_COLUMNS, row)}
+            for station_id, row in zip(self.station_ids, picked.tolist())
+            if not all(math.isnan(value) for value in row)
+        }
 
+    def rankings(self, window, station_meta, engine_name="light"):
+        """
+        {(territory, metric): ranked rows} for window, in the shape the
+        engines return for a report day, so it can be drawn like one.
+        "amplitude" is then the spread between the window's max and min.
+        Stations are classified quietly: the report day already logged and
+        counted the ones without a territory.
+        """
+        engine = ENGINES[engine_name]
+        label = f"{self.window_start(window):%Y-%m-%d}/{date.fromordinal(self.last_day):%Y-%m-%d}"
+        table = engine.classify(engine.build_table({label: self.window_aggregates(window)}, label), station_meta, quiet=True)
+        return engine.rank(table)
+
+
+def rolling_summary(state, station_meta, windows=ROLLING_WINDOWS):
+    """Top stations per window, territory and metric, as a JSON-ready dict."""
+    summary = {"last_day": f"{date.fromordinal(state.last_day):%Y-%m-%d}", "windows": {}}
+    for window in windows:
+        territories = {}
+        for (territory, metric), rows in state.rankings(window, station_meta).items():
+            column = RANK_METRICS[metric].column
+            territories.setdefault(territory, {})[metric] = [
+                {"stationId": str(record["stationId"]), "location": station_meta[str(record["stationId"])]["location"],
+                 "value": round(float(record[column]), 6)}
+                for record in _ranked_records(rows)
+            ]
+        summary["windows"][window] = {"start": f"{state.window_start(window):%Y-%m-%d}", "territories": territories}
+    return summary
+
+
+def update_rolling_extremes(days, station_meta, path=ROLLING_FILE, output_dir="."):
+    """
+    Add {report_date: {stationId: {column: value}}} days (in date order) to
+    the rolling state at path and rewrite the summary in output_dir.
+    Returns the number of days added.
+    """
+    with METRICS.span("load"):
+        state = RollingExtremes.load(path)
+    added = sum(state.update(report_date, days[report_date]) for report_date in sorted(days))
+    METRICS.count("rolling_days_added", added)
+    if not added:
+        logger.info("Rolling extremes already include these days")
+        return 0
+    with METRICS.span("save"):
+        state.save(path)
+    summary = rolling_summary(state, station_meta)
+    (Path(output_dir) / ROLLING_SUMMARY_FILE).write_text(json.dumps(summary, ensure_ascii=False, indent=1), encoding="utf-8")
+    logger.info(f"Rolling extremes updated to {summary['last_day']} ({len(state.station_ids)} stations)")
+    return added
 
 
 # ------------------------------
-#     PORTUGAL CONTINENTAL
+#            BACKFILL
 # ------------------------------
 
+# Days are built in parallel, one process per day; each day renders its
+# three territories inline so the pool isn't nested.
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", str(os.cpu_count() or 1)))
+
+
+def _backfill_day(report_date, json_data, station_meta, output_dir, encoder, engine_name, derivatives=()):
+    """Process pool task: build one day's reports from its daily aggregates."""
+    engine = ENGINES[engine_name]
+    day_dir = Path(output_dir) / report_date
+    day_dir.mkdir(parents=True, exist_ok=True)
+    ipma_data = engine.classify(engine.build_table(json_data, report_date), station_meta)
+    return render_reports(engine.rank(ipma_data), station_meta, report_date,
+                          workers=1, encoder=encoder, output_dir=day_dir, derivatives=derivatives)
 
-# Create Loop For Max Temperature 
-for x in range(len(four_temp_max_pt)):
-    name = getStationNameById(four_temp_max_pt.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("(CIM)", "").strip()
-    station_temp = str(four_temp_max_pt.iloc[x].temp_max)
-    color = four_temp_max_pt.iloc[x].colors
-    image_editable_pt.text((max_temp_station_name_x,max_temp_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_pt.text((max_temp_value_x, max_temp_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    max_temp_start_coords += 30
- 
- # Create Loop For Min Temperature 
-for x in range(len(four_temp_min_pt)):
-    name = getStationNameById(four_temp_min_pt.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("(CIM)", "").strip()
-    station_temp = str(four_temp_min_pt.iloc[x].temp_min)
-    color = four_temp_min_pt.iloc[x].colors
-    image_editable_pt.text((min_temp_station_name_x,min_temp_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_pt.text((min_temp_value_x, min_temp_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    min_temp_start_coords += 30  
-
-# Create Loop For Max Rainfall 
-for x in range(len(four_rain_accu_pt)):
-    name = getStationNameById(four_rain_accu_pt.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("(CIM)", "").strip()
-    station_temp = str(four_rain_accu_pt.iloc[x].prec_quant)
-    color = four_rain_accu_pt.iloc[x].colors
-    image_editable_pt.text((max_rain_station_name_x,max_rain_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_pt.text((max_rain_value_x, max_rain_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    max_rain_start_coords += 30
-
-# Create Loop For Max Wind Gust
-for x in range(len(four_wind_max_pt)):
-    name = getStationNameById(four_wind_max_pt.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("(CIM)", "").strip()
-    station_temp = str(four_wind_max_pt.iloc[x].vento_int_max_inst)
-    color = four_wind_max_pt.iloc[x].colors
-    image_editable_pt.text((max_wind_station_name_x,max_wind_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_pt.text((max_wind_value_x, max_wind_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    max_wind_start_coords += 30
-
-# Create Loop for Max Humidity 
-for x in range(len(four_hum_max_pt)):
-    name = getStationNameById(four_hum_max_pt.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("(CIM)", "").strip()
-    station_temp = str(four_hum_max_pt.iloc[x].hum_max)
-    color = four_hum_max_pt.iloc[x].colors
-    image_editable_pt.text((max_hum_station_name_x,max_hum_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_pt.text((max_hum_value_x, max_hum_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    max_hum_start_coords += 30
-
-# Create Loop for Min Humidity 
-for x in range(len(four_hum_min_pt)):
-    name = getStationNameById(four_hum_min_pt.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("(CIM)", "").strip()
-    station_temp = str(four_hum_min_pt.iloc[x].hum_min)
-    color = four_hum_min_pt.iloc[x].colors
-    image_editable_pt.text((min_hum_station_name_x,min_hum_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_pt.text((min_hum_value_x, min_hum_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    min_hum_start_coords += 30
-
-# Create Loop for Ampitude
-for x in range(len(df_amplitude_pt)):
-    name = getStationNameById(df_amplitude_pt.iloc[x].stationId)
-    station_name = name.location.values[0]
-    station_temp_max = str(df_amplitude_pt.iloc[x].temp_max)
-    station_temp_min = str(df_amplitude_pt.iloc[x].temp_min)
-    station_temp_amplitude = str(round(df_amplitude_pt.iloc[x].amplitude,2))
-    image_editable_pt.text((842,525), station_name,(0,0,0), font=location_font)
-    image_editable_pt.text((920,570), station_temp_max,(154,7,7), font=subtitle_font)
-    image_editable_pt.text((683,570), station_temp_min,(93,173,236), font=subtitle_font)
-    image_editable_pt.text((755,600), station_temp_amplitude,(250,186,61), font=amplitude_font)
+
+def backfill(start_date, end_date, output_dir="backfill", workers=BACKFILL_WORKERS, encoder=PNG_ENCODER,
+             engine_name=PIPELINE_ENGINE, derivatives=REPORT_DERIVATIVES):
+    """
+    Generate the PT/AZ/MAD reports for every day from start_date to end_date
+    (inclusive, YYYY-MM-DD) out of the local observation store, writing them
+    to output_dir/<date>/. Station metadata is loaded once and shared by all
+    days. Days without stored observations are skipped (counted as
+    backfill_days_skipped). Returns the number of days whose reports failed.
+    """
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    days = [(start + timedelta(days=i)).strftime("%Y-%m-%d")
+            for i in range((datetime.strptime(end_date, "%Y-%m-%d") - start).days + 1)]
+
+    day_data = {}
+    with METRICS.span("load"), ObservationStore() as store:
+        for report_date in days:
+            json_data = store.daily_aggregates(report_date)
+            if json_data:
+                day_data[report_date] = json_data
+            else:
+                logger.warning(f"No stored observations for {report_date}, skipping")
+                METRICS.count("backfill_days_skipped")
+
+    station_ids = {station_id for json_data in day_data.values() for stations in json_data.values() for station_id in stations}
+    with METRICS.span("stations"):
+        station_meta = resolve_station_metadata(sorted(station_ids), load_station_metadata())
+
+    tasks = [(report_date, json_data, station_meta, output_dir, encoder, engine_name, derivatives)
+             for report_date, json_data in day_data.items()]
+    failures = 0
+    results = []
+    with METRICS.span("days"), concurrent.futures.ProcessPoolExecutor(max_workers=max(1, min(workers, len(tasks)))) as pool:
+        futures = {pool.submit(_backfill_day, *task): task[0] for task in tasks}
+        for future, report_date in futures.items():
+            try:
+                results.append((report_date, future.result()))
+            except Exception as e:
+                logger.error(f"Backfill failed for {report_date}: {e}")
+                failures += 1
+
+    for report_date, outputs in results:
+        print(f"Generated report for {report_date}: {', '.join(outputs)}")
+
+    # Days older than the rolling state's last day are skipped, so this only seeds or extends it
+    if ROLLING_EXTREMES and day_data:
+        try:
+            with METRICS.span("rolling"):
+                update_rolling_extremes({report_date: json_data[report_date] for report_date, json_data in day_data.items()},
+                                        station_meta, output_dir=output_dir)
+        except Exception as e:
+            logger.warning(f"Could not update rolling extremes: {e}")
+    return failures
 
 
 # ------------------------------
-#           AÇORES
+#            MAIN
 # ------------------------------
 
-# Reset Coordinates
-
-# Right Column 
-
-max_temp_start_coords = 190 # This value increments by 30px every loop iteration
-max_temp_station_name_x = 115  # Where Station Name Appears 
-max_temp_value_x = 460  # Where Value Appears 
-
-min_temp_start_coords = 370 # This value increments by 30px every loop iteration
-min_temp_station_name_x = 115  # Where Station Name Appears 
-min_temp_value_x = 460  # Where Value Appears 
-
-max_rain_start_coords = 540 # This value increments by 30px every loop iteration
-max_rain_station_name_x = 115  # Where Station Name Appears 
-max_rain_value_x = 460  # Where Value Appears 
-
-max_wind_start_coords = 720 # This value increments by 30px every loop iteration
-max_wind_station_name_x = 115  # Where Station Name Appears 
-max_wind_value_x = 460  # Where Value Appears 
-
-
-# Left Column 
-
-max_hum_start_coords = 190 # This value increments by 30px every loop iteration
-max_hum_station_name_x = 650  # WHere Station Name Appears 
-max_hum_value_x = 950  # Where Value Appears 
-max_hum_unit_x = 970    # Where Unit Appears 
-
-min_hum_start_coords = 370 # This value increments by 30px every loop iteration
-min_hum_station_name_x = 650  # WHere Station Name Appears 
-min_hum_value_x = 950  # Where Value Appears 
-min_hum_unit_x = 970    # Where Unit Appears 
-
-# Create Loop For Max Temperature 
-for x in range(len(four_temp_max_az)):
-    name = getStationNameById(four_temp_max_az.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("(DROTRH)", "").strip()
-    station_temp = str(four_temp_max_az.iloc[x].temp_max)
-    color = four_temp_max_az.iloc[x].colors
-    image_editable_az.text((max_temp_station_name_x,max_temp_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_az.text((max_temp_value_x, max_temp_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    max_temp_start_coords += 30
- 
- # Create Loop For Min Temperature 
-for x in range(len(four_temp_min_az)):
-    name = getStationNameById(four_temp_min_az.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("(DROTRH)", "").strip()
-    station_temp = str(four_temp_min_az.iloc[x].temp_min)
-    color = four_temp_min_az.iloc[x].colors
-    image_editable_az.text((min_temp_station_name_x,min_temp_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_az.text((min_temp_value_x, min_temp_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    min_temp_start_coords += 30  
-
-# Create Loop For Max Rainfall 
-for x in range(len(four_rain_accu_az)):
-    name = getStationNameById(four_rain_accu_az.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("(DROTRH)", "").strip()
-    station_temp = str(four_rain_accu_az.iloc[x].prec_quant)
-    color = four_rain_accu_az.iloc[x].colors
-    image_editable_az.text((max_rain_station_name_x,max_rain_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_az.text((max_rain_value_x, max_rain_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    max_rain_start_coords += 30
-
-# Create Loop For Max Wind Gust
-for x in range(len(four_wind_max_az)):
-    name = getStationNameById(four_wind_max_az.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("(DROTRH)", "").strip()
-    station_temp = str(four_wind_max_az.iloc[x].vento_int_max_inst)
-    color = four_wind_max_az.iloc[x].colors
-    image_editable_az.text((max_wind_station_name_x,max_wind_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_az.text((max_wind_value_x, max_wind_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    max_wind_start_coords += 30
-
-# Create Loop for Max Humidity 
-for x in range(len(four_hum_max_az)):
-    name = getStationNameById(four_hum_max_az.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("(DROTRH)", "").strip()
-    station_temp = str(four_hum_max_az.iloc[x].hum_max)
-    color = four_hum_max_az.iloc[x].colors
-    image_editable_az.text((max_hum_station_name_x,max_hum_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_az.text((max_hum_value_x, max_hum_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    max_hum_start_coords += 30
-
-# Create Loop for Min Humidity 
-for x in range(len(four_hum_min_az)):
-    name = getStationNameById(four_hum_min_az.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("(DROTRH)", "").strip()
-    station_temp = str(four_hum_min_az.iloc[x].hum_min)
-    color = four_hum_min_az.iloc[x].colors
-    image_editable_az.text((min_hum_station_name_x,min_hum_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_az.text((min_hum_value_x, min_hum_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    min_hum_start_coords += 30
-
-# Create Loop for Ampitude
-for x in range(len(df_amplitude_az)):
-    name = getStationNameById(df_amplitude_az.iloc[x].stationId)
-    station_name = name.location.values[0]
-    station_temp_max = str(df_amplitude_az.iloc[x].temp_max)
-    station_temp_min = str(df_amplitude_az.iloc[x].temp_min)
-    station_temp_amplitude = str(round(df_amplitude_az.iloc[x].amplitude,2))
-    image_editable_az.text((842,525), station_name,(0,0,0), font=location_font)
-    image_editable_az.text((920,570), station_temp_max,(154,7,7), font=subtitle_font)
-    image_editable_az.text((683,570), station_temp_min,(93,173,236), font=subtitle_font)
-    image_editable_az.text((755,600), station_temp_amplitude,(250,186,61), font=amplitude_font)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the VOST daily weather report images.")
+    parser.add_argument("--backfill", nargs=2, metavar=("START", "END"),
+                        help="generate reports for every day from START to END (YYYY-MM-DD) "
+                             "from locally stored observations")
+    parser.add_argument("--output-dir", default="backfill",
+                        help="where backfilled reports are written, one folder per day (default: backfill)")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS,
+                        help="parallel days when backfilling (default: CPU count)")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default=PIPELINE_ENGINE,
+                        help="build and rank the station table with pandas or plain records (default: %(default)s)")
+    parser.add_argument("--derivatives", nargs="*", choices=sorted(DERIVATIVES), default=list(REPORT_DERIVATIVES),
+                        metavar="NAME", help=f"also write these formats of every report ({', '.join(DERIVATIVES)})")
+    parser.add_argument("--prometheus", metavar="FILE", default=RUN_METRICS_PROMETHEUS,
+                        help="also write the run metrics to FILE in Prometheus text format")
+    args = parser.parse_args(argv)
+    # Defaults from REPORT_DERIVATIVES aren't checked against the choices
+    unknown = sorted(set(args.derivatives) - set(DERIVATIVES))
+    if unknown:
+        parser.error(f"unknown derivative(s): {', '.join(unknown)}")
+    return args
+
+
+def daily_report(engine_name=PIPELINE_ENGINE, derivatives=REPORT_DERIVATIVES):
+    """Generate yesterday's reports (the scheduled run). Returns the exit code."""
+    engine = ENGINES[engine_name]
+    METRICS.info["engine"] = engine_name
+    # Check yesterday's date early (needed for IPMA fallback)
+    yesterday = datetime.now() - timedelta(1)
+    yesterday_date = datetime.strftime(yesterday, '%Y-%m-%d')
+
+    locks_dir = Path("locks")
+    locks_dir.mkdir(exist_ok=True)
+
+    # Delete old lock files
+    for old_lock in locks_dir.glob("generated_*.lock"):
+        if yesterday_date not in old_lock.name:
+            old_lock.unlink()
+
+    # Today's lock file
+    lock_file = locks_dir / f"generated_{yesterday_date}.lock"
+
+    # Skip if already generated
+    METRICS.info["report_date"] = yesterday_date
+    if lock_file.exists():
+        print(f"Report for {yesterday_date} already generated. Skipping.")
+        METRICS.info["outcome"] = "already_generated"
+        return 0
+
+    now_lisbon = datetime.now(ZoneInfo("Europe/Lisbon"))
+    before_deadline = now_lisbon.hour < REPORT_DEADLINE_HOUR
+    probed_hours = None
+
+    # Before the deadline, only commit to the full download once the day is complete
+    if before_deadline and IPMA_PROBE:
+        try:
+            with METRICS.span("probe"):
+                complete, probed_hours, source = probe_report_day(yesterday_date)
+        except Exception as e:
+            logger.warning(f"Completeness probe failed ({e}), fetching the full feed")
+        else:
+            print(f"Probe ({source}): {len(probed_hours)} hours available for {yesterday_date}")
+            if not complete:
+                print(
+                    f"Incomplete data ({len(probed_hours)} hours) "
+                    f"and before 05:00 Lisbon time. Skipping."
+                )
+                METRICS.info["hour_count"] = len(probed_hours)
+                METRICS.info["outcome"] = "incomplete_data"
+                return 0
+
+    # bot.fogos.pt has no hour keys, so before the deadline it can't show the day
+    # is complete. Unless the probe already has, it must not race (and cancel) IPMA.
+    hedge_delay = FETCH_HEDGE_DELAY if probed_hours is not None or not before_deadline else None
+
+    # Fetch data (bot.fogos.pt or IPMA API fallback)
+    with METRICS.span("fetch"):
+        json_data = fetch_observations_data(yesterday_date, hedge_delay=hedge_delay)
+
+    # A probe-confirmed day stays complete whichever source won
+    hourly_keys = json_data.pop("_hourly_keys", probed_hours or [])
+
+    print(f"Fetched data for {len(json_data)} dates")
+
+    hours_yesterday = sorted(set(hourly_keys).intersection(report_day_hours(yesterday_date)))
+
+    hour_count = len(hours_yesterday)
+    METRICS.info["hour_count"] = hour_count
+
+    print(f"Hours available for {yesterday_date}: {hours_yesterday}")
+    print(f"Hour count: {hour_count}")
+    print(f"Current Lisbon time: {now_lisbon:%Y-%m-%d %H:%M:%S}")
+
+    if hour_count < MIN_REPORT_HOURS and before_deadline:
+        print(
+            f"Incomplete data ({hour_count} hours) "
+            f"and before 05:00 Lisbon time. Skipping."
+        )
+        METRICS.info["outcome"] = "incomplete_data"
+        return 0
 
+    print("Proceeding with report generation.")
 
+    with METRICS.span("build_table"):
+        ipma_data_yesterday = engine.build_table(json_data, yesterday_date)
+    station_ids = engine.station_ids(ipma_data_yesterday)
 
-# ------------------------------
-#           MADEIRA
-# ------------------------------
+    report_date = str(yesterday_date)
 
-# Reset Coordinates
-
-# Right Column 
-
-max_temp_start_coords = 190 # This value increments by 30px every loop iteration
-max_temp_station_name_x = 115  # Where Station Name Appears 
-max_temp_value_x = 460  # Where Value Appears 
-
-min_temp_start_coords = 370 # This value increments by 30px every loop iteration
-min_temp_station_name_x = 115  # Where Station Name Appears 
-min_temp_value_x = 460  # Where Value Appears 
-
-max_rain_start_coords = 540 # This value increments by 30px every loop iteration
-max_rain_station_name_x = 115  # Where Station Name Appears 
-max_rain_value_x = 460  # Where Value Appears 
-
-max_wind_start_coords = 720 # This value increments by 30px every loop iteration
-max_wind_station_name_x = 115  # Where Station Name Appears 
-max_wind_value_x = 460  # Where Value Appears 
-
-
-# Left Column 
-
-max_hum_start_coords = 190 # This value increments by 30px every loop iteration
-max_hum_station_name_x = 650  # WHere Station Name Appears 
-max_hum_value_x = 950  # Where Value Appears 
-max_hum_unit_x = 970    # Where Unit Appears 
-
-min_hum_start_coords = 370 # This value increments by 30px every loop iteration
-min_hum_station_name_x = 650  # WHere Station Name Appears 
-min_hum_value_x = 950  # Where Value Appears 
-min_hum_unit_x = 970    # Where Unit Appears 
-
-# Create Loop For Max Temperature 
-for x in range(len(four_temp_max_mad)):
-    name = getStationNameById(four_temp_max_mad.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("Madeira,", "").strip()
-    station_temp = str(four_temp_max_mad.iloc[x].temp_max)
-    color = four_temp_max_mad.iloc[x].colors
-    image_editable_mad.text((max_temp_station_name_x,max_temp_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_mad.text((max_temp_value_x, max_temp_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    max_temp_start_coords += 30
- 
- # Create Loop For Min Temperature 
-for x in range(len(four_temp_min_mad)):
-    name = getStationNameById(four_temp_min_mad.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("Madeira,", "").strip()
-    station_temp = str(four_temp_min_mad.iloc[x].temp_min)
-    color = four_temp_min_mad.iloc[x].colors
-    image_editable_mad.text((min_temp_station_name_x,min_temp_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_mad.text((min_temp_value_x, min_temp_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    min_temp_start_coords += 30  
-
-# Create Loop For Max Rainfall 
-for x in range(len(four_rain_accu_mad)):
-    name = getStationNameById(four_rain_accu_mad.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("Madeira,", "").strip()
-    station_temp = str(four_rain_accu_mad.iloc[x].prec_quant)
-    color = four_rain_accu_mad.iloc[x].colors
-    image_editable_mad.text((max_rain_station_name_x,max_rain_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_mad.text((max_rain_value_x, max_rain_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    max_rain_start_coords += 30
-
-# Create Loop For Max Wind Gust
-for x in range(len(four_wind_max_mad)):
-    name = getStationNameById(four_wind_max_mad.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("Madeira,", "").strip()
-    station_temp = str(four_wind_max_mad.iloc[x].vento_int_max_inst)
-    color = four_wind_max_mad.iloc[x].colors
-    image_editable_mad.text((max_wind_station_name_x,max_wind_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_mad.text((max_wind_value_x, max_wind_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    max_wind_start_coords += 30
-
-# Create Loop for Max Humidity 
-for x in range(len(four_hum_max_mad)):
-    name = getStationNameById(four_hum_max_mad.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("Madeira,", "").strip()
-    station_temp = str(four_hum_max_mad.iloc[x].hum_max)
-    color = four_hum_max_mad.iloc[x].colors
-    image_editable_mad.text((max_hum_station_name_x,max_hum_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_mad.text((max_hum_value_x, max_hum_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    max_hum_start_coords += 30
-
-# Create Loop for Min Humidity 
-for x in range(len(four_hum_min_mad)):
-    name = getStationNameById(four_hum_min_mad.iloc[x].stationId)
-    station_name = name.location.values[0]
-    # Strip station names 
-    station_name_final = station_name.replace("Madeira,", "").strip()
-    station_temp = str(four_hum_min_mad.iloc[x].hum_min)
-    color = four_hum_min_mad.iloc[x].colors
-    image_editable_mad.text((min_hum_station_name_x,min_hum_start_coords), station_name_final, color, font=subtitle_font)
-    image_editable_mad.text((min_hum_value_x, min_hum_start_coords), station_temp, color, font=subtitle_font)
-    
-
-    # Increase y coordinates by 30px 
-    min_hum_start_coords += 30
-
-# Create Loop for Ampitude
-for x in range(len(df_amplitude_mad)):
-    name = getStationNameById(df_amplitude_mad.iloc[x].stationId)
-    station_name = name.location.values[0]
-    station_temp_max = str(df_amplitude_mad.iloc[x].temp_max)
-    station_temp_min = str(df_amplitude_mad.iloc[x].temp_min)
-    station_temp_amplitude = str(round(df_amplitude_mad.iloc[x].amplitude,2))
-    image_editable_mad.text((842,525), station_name,(0,0,0), font=location_font)
-    image_editable_mad.text((920,570), station_temp_max,(154,7,7), font=subtitle_font)
-    image_editable_mad.text((683,570), station_temp_min,(93,173,236), font=subtitle_font)
-    image_editable_mad.text((755,600), station_temp_amplitude,(250,186,61), font=amplitude_font)
+    print(report_date)
 
-#---------------------------------
-#      INSERT DATES
-#---------------------------------
+    # Add logging for dataframe info
+    logger.info(f"Processing {len(ipma_data_yesterday)} records from {yesterday_date}")
+    logger.info(f"Sample station IDs: {station_ids[:5]}")
 
-# Insert Report Dates
-image_editable_pt.text((29,1020), report_date,(255,255,255), font=date_font)
-image_editable_az.text((29,1020), report_date,(255,255,255), font=date_font)
-image_editable_mad.text((29,1020), report_date,(255,255,255), font=date_font)
+    # Load station metadata once; shared by the territory split and the renderer
+    with METRICS.span("stations"):
+        station_meta = resolve_station_metadata(station_ids, load_station_metadata())
+
+    with METRICS.span("classify"):
+        ipma_data_yesterday = engine.classify(ipma_data_yesterday, station_meta)
+
+    with METRICS.span("rank"):
+        rankings = engine.rank(ipma_data_yesterday)
+
+    # Draw and Save Resulting Pictures
+    with METRICS.span("render"):
+        render_reports(rankings, station_meta, report_date, derivatives=derivatives)
+
+    # Multi-day extremes are extra; failing to update them never fails the report
+    if ROLLING_EXTREMES:
+        try:
+            with METRICS.span("rolling"):
+                update_rolling_extremes({yesterday_date: json_data[yesterday_date]}, station_meta)
+        except Exception as e:
+            logger.warning(f"Could not update rolling extremes: {e}")
+
+    lock_file.write_text(f"Generated report for {yesterday_date}\n")
+    METRICS.info["outcome"] = "generated"
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report_dir = Path(args.output_dir) if args.backfill else Path(".")
+    try:
+        with METRICS.span("run"):
+            if args.backfill:
+                METRICS.info["backfill"] = args.backfill
+                failures = backfill(*args.backfill, output_dir=args.output_dir, workers=args.workers,
+                                    engine_name=args.engine, derivatives=tuple(args.derivatives))
+                METRICS.info["outcome"] = "backfilled" if not failures else f"{failures} day(s) failed"
+                return 1 if failures else 0
+            return daily_report(args.engine, tuple(args.derivatives))
+    except Exception as e:
+        METRICS.info["outcome"] = "error"
+        METRICS.info["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        # Lock skips happen every scheduled hour after success; keep that run's report
+        if METRICS.info.get("outcome") != "already_generated":
+            report_dir.mkdir(parents=True, exist_ok=True)
+            METRICS.write_json(report_dir / RUN_REPORT_FILE)
+            if args.prometheus:
+                METRICS.write_prometheus(args.prometheus)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
 
-#---------------------------------
-#         SAVE PICTURES
-#---------------------------------
-# Save Resulting Pictures
-template_pt.save("daily_meteo_report_pt.png")
-template_az.save("daily_meteo_report_az.png")
-template_mad.save("daily_meteo_report_mad.png")
 
-lock_file.write_text(f"Generated report for {yesterday_date}\n")
 #---------------------------------
 #         THE END
 #---------------------------------
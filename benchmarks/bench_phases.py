@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+# ------------------------------
+#       DESCRIPTION
+# ------------------------------
+
+# Phase-level benchmark for the daily report pipeline.
+# Generates synthetic IPMA observations.json payloads and station metadata
+# of configurable size, times every phase of the nightly run separately and
+# writes the results as JSON, optionally comparing them against a baseline:
+#
+#   python benchmarks/bench_phases.py --stations 200 2000 20000 --hours 24 168 \
+#       --save benchmarks/baselines/local.json
+#   python benchmarks/bench_phases.py --compare benchmarks/baselines/local.json
+#
+# No network access is needed; PNGs are encoded to memory.
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import numpy as np
+import pandas as pd
+import PIL
+
+import app
+
+# Share of stations per territory; the rest have no metadata and are dropped as Unknown
+TERRITORY_SHARE = (("Portugal", 0.75), ("Açores", 0.1), ("Madeira", 0.13))
+REPORT_DATE = "2024-07-15"
+
+PHASES = ("aggregate", "store_merge", "dataframe", "territory_split", "ranking", "drawing", "png_save")
+
+
+# ------------------------------
+#       SYNTHETIC DATA
+# ------------------------------
+
+def synthetic_feed(stations, hours, missing_ratio, report_date=REPORT_DATE, seed=0):
+    """
+    Return an IPMA-shaped {hour: {stationId: {...}}} document with `hours`
+    hourly entries ending at the report day's last hour. Each reading is
+    -99.0 (missing) with probability missing_ratio.
+    """
+    rng = random.Random(seed)
+    end = datetime.strptime(report_date, "%Y-%m-%d") + timedelta(hours=23)
+    ids = [str(1200000 + i) for i in range(stations)]
+
+    def reading(low, high, ndigits=1):
+        return -99.0 if rng.random() < missing_ratio else round(rng.uniform(low, high), ndigits)
+
+    feed = {}
+    for h in range(hours - 1, -1, -1):
+        key = (end - timedelta(hours=h)).strftime("%Y-%m-%dT%H:%M")
+        feed[key] = {
+            station_id: {
+                "temperatura": reading(-5, 42),
+                "humidade": reading(5, 100, 0),
+                "intensidadeVentoKM": reading(0, 120),
+                "precAcumulada": reading(0, 40),
+                "idDireccVento": rng.randint(0, 9),
+                "pressao": reading(980, 1040),
+                "radiacao": reading(0, 3500),
+            }
+            for station_id in ids
+        }
+    return feed
+
+
+def synthetic_station_meta(feed, seed=0):
+    """Station metadata in the same shape as load_station_metadata() for every station in feed."""
+    rng = random.Random(seed)
+    stations = {}
+    for station_id in next(iter(feed.values())):
+        roll, place = rng.random(), None
+        for territory, share in TERRITORY_SHARE:
+            if roll < share:
+                place = territory
+                break
+            roll -= share
+        prefix = f"{place}, " if place in ("Açores", "Madeira") else ""
+        stations[station_id] = {
+            "place": place,
+            "location": f"{prefix}Estação {station_id} (CIM)",
+            "coordinates": {"lat": rng.uniform(32, 42), "lng": rng.uniform(-31, -6)},
+        }
+    return stations
+
+
+# ------------------------------
+#          TIMING
+# ------------------------------
+
+def _byte_chunks(body, size=app.IPMA_STREAM_CHUNK_SIZE):
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+
+def run_once(body, station_meta, report_date, tmp_dir, engine=app.ENGINES["pandas"]):
+    """Run every phase once over an encoded feed. Returns {phase: seconds}."""
+    timings = {}
+
+    def timed(phase, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start
+        return result
+
+    # Streaming parse + hourly → daily reduction, as fetch_from_ipma_api does
+    def aggregate():
+        hourly_keys = []
+        records = app._iter_hourly_records(app._iter_text_chunks(_byte_chunks(body), "utf-8"), hourly_keys)
+        return app._aggregate_report_day(records, hourly_keys, report_date, use_store=False)
+
+    json_data = timed("aggregate", aggregate)
+    json_data.pop("_hourly_keys", None)
+
+    # Same input merged into a fresh SQLite observation store
+    def store_merge():
+        store_file = Path(tmp_dir) / "observations.sqlite"
+        store_file.unlink(missing_ok=True)
+        with app.ObservationStore(store_file) as store:
+            store.merge(app._iter_hourly_records(app._iter_text_chunks(_byte_chunks(body), "utf-8")))
+            return store.daily_aggregates(report_date)
+
+    timed("store_merge", store_merge)
+
+    table = timed("dataframe", engine.build_table, json_data, report_date)
+    table = timed("territory_split", engine.classify, table, station_meta)
+    rankings = timed("ranking", engine.rank, table)
+
+    for territory in app.TERRITORY_LAYOUTS:
+        image = timed("drawing", app.render_report, territory, rankings, station_meta, report_date)
+        timed("png_save", app.save_png, image, io.BytesIO(), app.PNG_ENCODER)
+
+    return timings
+
+
+def bench_case(stations, hours, missing_ratio, repeat, seed=0, engine_name="pandas"):
+    feed = synthetic_feed(stations, hours, missing_ratio, seed=seed)
+    station_meta = synthetic_station_meta(feed, seed=seed)
+    body = json.dumps(feed).encode("utf-8")
+    del feed
+
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # One untimed run to warm the template and font caches like a second nightly run would
+        engine = app.ENGINES[engine_name]
+        run_once(body, station_meta, REPORT_DATE, tmp_dir, engine)
+        for _ in range(repeat):
+            runs.append(run_once(body, station_meta, REPORT_DATE, tmp_dir, engine))
+
+    phases = {}
+    for phase in PHASES:
+        samples = [run[phase] for run in runs]
+        phases[phase] = {"median": statistics.median(samples), "min": min(samples)}
+    return {
+        "stations": stations,
+        "hours": hours,
+        "missing_ratio": missing_ratio,
+        "engine": engine_name,
+        "feed_bytes": len(body),
+        "repeat": repeat,
+        "phases": phases,
+    }
+
+
+# ------------------------------
+#      BASELINES / COMPARE
+# ------------------------------
+
+def case_name(stations, hours, missing_ratio, engine_name="pandas"):
+    name = f"stations={stations},hours={hours},missing={missing_ratio}"
+    # Keep pandas case names unchanged so older baselines still compare
+    return name if engine_name == "pandas" else f"{name},engine={engine_name}"
+
+
+def environment():
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "pillow": PIL.__version__,
+    }
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """
+    Return a list of (case, phase, baseline, current) where the current median
+    is more than `tolerance` (fraction) and `min_delta` seconds slower.
+    """
+    regressions = []
+    for name, case in results["cases"].items():
+        base_case = baseline.get("cases", {}).get(name)
+        if base_case is None:
+            continue
+        for phase, stats in case["phases"].items():
+            base = base_case["phases"].get(phase)
+            if base is None:
+                continue
+            current, previous = stats["median"], base["median"]
+            if current > previous * (1 + tolerance) and current - previous > min_delta:
+                regressions.append((name, phase, previous, current))
+    return regressions
+
+
+def print_table(results):
+    print(f"{'case':<56}" + "".join(f"{p:>16}" for p in PHASES))
+    for name, case in results["cases"].items():
+        print(f"{name:<56}" + "".join(f"{case['phases'][p]['median'] * 1000:>14.1f}ms" for p in PHASES))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time each phase of the daily report pipeline on synthetic IPMA feeds.")
+    parser.add_argument("--stations", type=int, nargs="+", default=[200, 2000, 20000])
+    parser.add_argument("--hours", type=int, nargs="+", default=[24])
+    parser.add_argument("--missing-ratio", type=float, default=0.05,
+                        help="probability of a -99.0 reading (default: 0.05)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case (default: 3)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", choices=sorted(app.ENGINES), nargs="+", default=["pandas"],
+                        help="table engine(s) to time (default: pandas)")
+    parser.add_argument("--save", metavar="FILE", help="write the results as JSON to FILE")
+    parser.add_argument("--compare", metavar="FILE", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown per phase before it counts as a regression (default: 0.25)")
+    parser.add_argument("--min-delta", type=float, default=0.005,
+                        help="ignore slowdowns smaller than this many seconds (default: 0.005)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Templates and the font are looked up relative to the repository root
+    os.chdir(ROOT)
+    # Synthetic stations without metadata are expected; don't log each one
+    app.logger.setLevel(logging.ERROR)
+
+    results = {"environment": environment(), "cases": {}}
+    for stations in args.stations:
+        for hours in args.hours:
+            for engine_name in args.engine:
+                name = case_name(stations, hours, args.missing_ratio, engine_name)
+                print(f"Running {name}...", file=sys.stderr)
+                results["cases"][name] = bench_case(stations, hours, args.missing_ratio, args.repeat, args.seed, engine_name)
+
+    print_table(results)
+
+    if args.save:
+        Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.save).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        for name, phase, previous, current in regressions:
+            print(f"REGRESSION {name} {phase}: {previous * 1000:.1f}ms -> {current * 1000:.1f}ms "
+                  f"({current / previous - 1:+.0%})")
+        if regressions:
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# ------------------------------
+#       DESCRIPTION
+# ------------------------------
+
+# Equivalence check between the pandas and the light (pandas-free) engines.
+# Builds, splits and ranks synthetic days with both and compares every ranked
+# row as it would be drawn; with --render the report images are compared too.
+#
+#   python benchmarks/compare_engines.py --trials 200 --render
+#
+# Exits non-zero on the first difference.
+
+import argparse
+import json
+import os
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_phases import ROOT, synthetic_feed, synthetic_station_meta
+
+import app
+
+
+def daily_data(stations, missing_ratio, ndigits, seed):
+    """Daily aggregates for a synthetic day, rounded to ndigits to force ties."""
+    feed = synthetic_feed(stations, 24, missing_ratio, seed=seed)
+    hourly_keys = []
+    json_data = app._aggregate_report_day(app._iter_records_from_dict(feed, hourly_keys), hourly_keys,
+                                          next(iter(feed))[:10], use_store=False)
+    json_data.pop("_hourly_keys")
+    for day in json_data.values():
+        for obs in day.values():
+            for column, value in obs.items():
+                obs[column] = round(value, ndigits) if ndigits > 0 else int(round(value))
+    return json_data, synthetic_station_meta(feed, seed)
+
+
+def drawn_rows(rankings, station_meta):
+    """What the renderer would print for every ranked row."""
+    rows = {}
+    for key, ranked in rankings.items():
+        rows[key] = [
+            (str(record["stationId"]), station_meta[str(record["stationId"])]["location"],
+             str(record["date"]), *(app._round2(record[column]) if column == "amplitude" else str(record[column])
+                                    for column in app.STATION_COLUMNS + ("amplitude",)))
+            for record in app._ranked_records(ranked)
+        ]
+    return rows
+
+
+def compare_day(json_data, station_meta, render=False):
+    report_date = next(iter(json_data))
+    results = {}
+    for name, engine in app.ENGINES.items():
+        table = engine.classify(engine.build_table(json.loads(json.dumps(json_data)), report_date), station_meta)
+        results[name] = engine.rank(table)
+
+    expected, actual = drawn_rows(results["pandas"], station_meta), drawn_rows(results["light"], station_meta)
+    for key in expected:
+        if expected[key] != actual[key]:
+            return f"{key}: pandas {expected[key]} != light {actual[key]}"
+
+    if render:
+        for territory in app.TERRITORY_LAYOUTS:
+            images = [app.render_report(territory, results[name], station_meta, report_date).tobytes()
+                      for name in ("pandas", "light")]
+            if images[0] != images[1]:
+                return f"{territory}: rendered images differ"
+    return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Check the light engine against the pandas engine.")
+    parser.add_argument("--trials", type=int, default=100)
+    parser.add_argument("--render", action="store_true", help="also compare rendered images (first trials only)")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Templates and the font are looked up relative to the repository root
+    os.chdir(ROOT)
+    app.logger.disabled = True
+    rng = random.Random(args.seed)
+    for trial in range(args.trials):
+        stations = rng.choice((3, 20, 60, 300))
+        missing_ratio = rng.choice((0.0, 0.05, 0.3, 0.9))
+        ndigits = rng.choice((0, 1, 2))
+        json_data, station_meta = daily_data(stations, missing_ratio, ndigits, seed=trial + args.seed)
+        difference = compare_day(json_data, station_meta, render=args.render and trial < 10)
+        if difference:
+            print(f"trial {trial} (stations={stations}, missing={missing_ratio}, ndigits={ndigits}): {difference}")
+            return 1
+    print(f"{args.trials} trials: pandas and light engines agree")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+# ------------------------------
+#       DESCRIPTION
+# ------------------------------
+
+# Record-and-replay stand-in for the endpoints app.py talks to (IPMA's
+# observations.json, bot.fogos.pt and api.fogos.pt's v1/v2 station lists).
+#
+#   record: capture real responses into a fixture directory
+#       python benchmarks/http_standin.py record fixtures/live --station-id 1210702
+#   synth:  write synthetic fixtures for yesterday (no network needed)
+#       python benchmarks/http_standin.py synth fixtures/synthetic --stations 2000
+#   serve:  replay a fixture directory on a local HTTP server, with faults
+#       python benchmarks/http_standin.py serve fixtures/live --latency 0.2 \
+#           --latency stations_v2=1.5 --fault ipma=429 --fault bot_fogos=cloudflare
+#
+# serve prints the URL_* variables that point app.py at the stand-in.
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import requests
+
+import app
+
+# Fixture name -> (app.py URL setting, live URL)
+ROUTES = {
+    "ipma": ("URL_IPMA_API", app.URL_IPMA_API),
+    "bot_fogos": ("URL_BOT_FOGOS", app.URL_BOT_FOGOS),
+    "stations_v2": ("URL_FOGOS_STATIONS_V2", app.URL_FOGOS_STATIONS_V2),
+    "stations_v1": ("URL_FOGOS_STATIONS_V1", app.URL_FOGOS_STATIONS_V1),
+}
+FAULTS = ("429", "cloudflare", "timeout", "error", "reset")
+INDEX_FILE = "index.json"
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+CLOUDFLARE_PAGE = (
+    b"<!DOCTYPE html><html><head><title>Access denied | bot.fogos.pt used Cloudflare to restrict access</title></head>"
+    b"<body><h1>Access denied</h1><p>The owner of this website has banned your access based on your browser's signature."
+    b"</p><p>Performance &amp; security by Cloudflare</p></body></html>"
+)
+
+
+# ------------------------------
+#        FIXTURE FILES
+# ------------------------------
+
+def _save(fixture_dir, index, name, url, status, headers, body):
+    path = urlparse(url)
+    key = path.path + (f"?{path.query}" if path.query else "")
+    body_file = f"{name}.body"
+    (fixture_dir / body_file).write_bytes(body)
+    index[key] = {"name": name, "status": status, "headers": headers, "body": body_file}
+
+
+def _write_index(fixture_dir, index):
+    (fixture_dir / INDEX_FILE).write_text(json.dumps(index, indent=1, sort_keys=True), encoding="utf-8")
+
+
+def record(fixture_dir, station_ids=()):
+    """Fetch every endpoint once (plus per-id station lookups) and store the responses."""
+    fixture_dir = Path(fixture_dir)
+    fixture_dir.mkdir(parents=True, exist_ok=True)
+    headers = {"ipma": app.HEADERS, "bot_fogos": app.HEADERS}
+    index = {}
+
+    urls = [(name, url) for name, (_, url) in ROUTES.items()]
+    for station_id in station_ids:
+        urls.append((f"stations_v2-{station_id}", f"{app.URL_FOGOS_STATIONS_V2}?id={station_id}"))
+
+    for name, url in urls:
+        try:
+            r = requests.get(url, headers=headers.get(name, {"User-Agent": "VostPTExtremosMeteo/1.0"}), timeout=60)
+        except requests.exceptions.RequestException as e:
+            print(f"{name}: {e}, not recorded", file=sys.stderr)
+            continue
+        kept = {h: r.headers[h] for h in KEPT_HEADERS if h in r.headers}
+        _save(fixture_dir, index, name, url, r.status_code, kept, r.content)
+        print(f"{name}: HTTP {r.status_code}, {len(r.content)} bytes", file=sys.stderr)
+
+    _write_index(fixture_dir, index)
+
+
+def synthesize(fixture_dir, stations, hours, missing_ratio, seed=0):
+    """Write fixtures for yesterday built from the benchmark's synthetic feed."""
+    from bench_phases import synthetic_feed, synthetic_station_meta
+
+    fixture_dir = Path(fixture_dir)
+    fixture_dir.mkdir(parents=True, exist_ok=True)
+    report_date = (datetime.now() - timedelta(1)).strftime("%Y-%m-%d")
+    feed = synthetic_feed(stations, hours, missing_ratio, report_date=report_date, seed=seed)
+    station_list = [{"id": int(station_id), **record} for station_id, record in synthetic_station_meta(feed, seed).items()]
+
+    hourly_keys = []
+    daily = app._aggregate_report_day(app._iter_records_from_dict(feed, hourly_keys), hourly_keys, report_date, use_store=False)
+    daily.pop("_hourly_keys", None)
+
+    index = {}
+    json_headers = {"Content-Type": "application/json"}
+    ipma_headers = dict(json_headers, ETag=f'"synthetic-{stations}-{hours}-{seed}"')
+    _save(fixture_dir, index, "ipma", app.URL_IPMA_API, 200, ipma_headers, json.dumps(feed).encode("utf-8"))
+    page = f"<html><script>var observations = {json.dumps(daily)};</script></html>"
+    _save(fixture_dir, index, "bot_fogos", app.URL_BOT_FOGOS, 200, {"Content-Type": "text/html"}, page.encode("utf-8"))
+    body = json.dumps({"success": True, "data": station_list}, ensure_ascii=False).encode("utf-8")
+    _save(fixture_dir, index, "stations_v2", app.URL_FOGOS_STATIONS_V2, 200, json_headers, body)
+    _save(fixture_dir, index, "stations_v1", app.URL_FOGOS_STATIONS_V1, 200, json_headers, body)
+    _write_index(fixture_dir, index)
+
+
+# ------------------------------
+#          REPLAY
+# ------------------------------
+
+def _filter_station(body, station_id):
+    """A per-id response cut from a recorded bulk station list."""
+    payload = json.loads(body)
+    records = payload.get("data", payload) if isinstance(payload, dict) else payload
+    matches = [r for r in records or [] if isinstance(r, dict) and str(r.get("id")) == station_id]
+    if isinstance(payload, dict):
+        return json.dumps(dict(payload, data=matches), ensure_ascii=False).encode("utf-8")
+    return json.dumps(matches, ensure_ascii=False).encode("utf-8")
+
+
+class StandIn(ThreadingHTTPServer):
+    """
+    Serves a fixture directory. faults maps a fixture name to (kind, probability),
+    latency maps a fixture name (or None for the default) to seconds of delay.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, fixture_dir, faults=None, latency=None, jitter=0.0, hang=90.0, seed=0):
+        super().__init__(address, _Handler)
+        self.fixture_dir = Path(fixture_dir)
+        self.index = json.loads((self.fixture_dir / INDEX_FILE).read_text(encoding="utf-8"))
+        self.faults = faults or {}
+        self.latency = latency or {}
+        self.jitter = jitter
+        self.hang = hang
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.served = {}
+
+    def url(self, name):
+        path = next((key for key, entry in self.index.items() if entry["name"] == name), None)
+        if path is None:
+            return None
+        return f"http://{self.server_address[0]}:{self.server_address[1]}{path}"
+
+    def random(self):
+        with self.rng_lock:
+            return self.rng.random()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        entry = server.index.get(self.path) or server.index.get(url.path)
+        if entry is None:
+            return self._send(404, {"Content-Type": "text/plain"}, b"not recorded")
+        # Per-id recordings ("stations_v2-1210702") share their route's settings
+        name = entry["name"].split("-")[0]
+        with server.rng_lock:
+            server.served[name] = server.served.get(name, 0) + 1
+
+        delay = server.latency.get(name, server.latency.get(None, 0.0))
+        if server.jitter:
+            delay += server.random() * server.jitter
+        time.sleep(delay)
+
+        kind, probability = server.faults.get(name, (None, 0.0))
+        if kind and server.random() < probability:
+            return self._fault(kind)
+
+        body = (server.fixture_dir / entry["body"]).read_bytes()
+        station_id = parse_qs(url.query).get("id", [None])[0]
+        if station_id is not None and self.path not in server.index:
+            body = _filter_station(body, station_id)
+
+        etag = entry["headers"].get("ETag")
+        if etag and self.headers.get("If-None-Match") == etag:
+            return self._send(304, {"ETag": etag}, b"")
+        self._send(entry["status"], entry["headers"], body)
+
+    def _fault(self, kind):
+        if kind == "429":
+            self._send(429, {"Content-Type": "text/plain", "Retry-After": "30"}, b"Too Many Requests")
+        elif kind == "cloudflare":
+            self._send(403, {"Content-Type": "text/html"}, CLOUDFLARE_PAGE)
+        elif kind == "error":
+            self._send(500, {"Content-Type": "text/plain"}, b"Internal Server Error")
+        elif kind == "timeout":
+            # Hold the connection open past the client's read timeout
+            time.sleep(self.server.hang)
+            self.close_connection = True
+        elif kind == "reset":
+            self.close_connection = True
+
+    def _send(self, status, headers, body):
+        self.send_response(status)
+        for header, value in headers.items():
+            if header != "Content-Length":
+                self.send_header(header, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        sys.stderr.write(f"standin {self.address_string()} {format % args}\n")
+
+
+def serve(fixture_dir, host="127.0.0.1", port=0, **options):
+    """Start a StandIn on a background thread and return it (call shutdown() to stop)."""
+    server = StandIn((host, port), fixture_dir, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ------------------------------
+#            CLI
+# ------------------------------
+
+def _parse_fault(text):
+    name, _, spec = text.partition("=")
+    kind, _, probability = spec.partition(":")
+    if name not in ROUTES or kind not in FAULTS:
+        raise argparse.ArgumentTypeError(f"expected ROUTE=KIND[:PROBABILITY] with ROUTE in {list(ROUTES)} and KIND in {FAULTS}")
+    return name, (kind, float(probability or 1.0))
+
+
+def _parse_latency(text):
+    name, _, seconds = text.rpartition("=")
+    if name and name not in ROUTES:
+        raise argparse.ArgumentTypeError(f"unknown route {name!r}, expected one of {list(ROUTES)}")
+    return name or None, float(seconds)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Record and replay the HTTP endpoints used by app.py.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rec = commands.add_parser("record", help="capture live responses into a fixture directory")
+    rec.add_argument("fixtures")
+    rec.add_argument("--station-id", action="append", default=[], help="also record a per-id station lookup")
+
+    synth = commands.add_parser("synth", help="write synthetic fixtures for yesterday")
+    synth.add_argument("fixtures")
+    synth.add_argument("--stations", type=int, default=200)
+    synth.add_argument("--hours", type=int, default=72)
+    synth.add_argument("--missing-ratio", type=float, default=0.05)
+    synth.add_argument("--seed", type=int, default=0)
+
+    srv = commands.add_parser("serve", help="replay a fixture directory")
+    srv.add_argument("fixtures")
+    srv.add_argument("--host", default="127.0.0.1")
+    srv.add_argument("--port", type=int, default=8765)
+    srv.add_argument("--latency", type=_parse_latency, action="append", default=[], metavar="[ROUTE=]SECONDS",
+                     help="delay before answering, for every route or just ROUTE")
+    srv.add_argument("--jitter", type=float, default=0.0, help="extra random delay of up to this many seconds")
+    srv.add_argument("--fault", type=_parse_fault, action="append", default=[], metavar="ROUTE=KIND[:P]",
+                     help=f"answer ROUTE with a fault ({', '.join(FAULTS)}) with probability P (default 1)")
+    srv.add_argument("--hang", type=float, default=90.0, help="how long a 'timeout' fault holds the connection")
+    srv.add_argument("--seed", type=int, default=0, help="seed for jitter and fault probabilities")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "record":
+        record(args.fixtures, args.station_id)
+        return 0
+    if args.command == "synth":
+        synthesize(args.fixtures, args.stations, args.hours, args.missing_ratio, args.seed)
+        return 0
+
+    server = StandIn((args.host, args.port), args.fixtures, faults=dict(args.fault), latency=dict(args.latency),
+                     jitter=args.jitter, hang=args.hang, seed=args.seed)
+    for name, (setting, _) in ROUTES.items():
+        if server.url(name):
+            print(f"export {setting}={server.url(name)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Served: {server.served}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
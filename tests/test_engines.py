@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+# The pandas and light engines must rank (and draw) every day identically.
+# A small, seeded slice of benchmarks/compare_engines.py; run that script for
+# the long randomised version.
+
+import itertools
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from compare_engines import compare_day, daily_data
+
+# Tiny and sparse days, heavy missing data and rounding that forces ties
+CASES = list(itertools.product((3, 20, 60), (0.0, 0.3, 0.9), (0, 1)))
+
+
+@pytest.mark.parametrize("seed, case", list(enumerate(CASES)))
+def test_engines_rank_alike(seed, case):
+    stations, missing_ratio, ndigits = case
+    json_data, station_meta = daily_data(stations, missing_ratio, ndigits, seed=seed)
+    assert compare_day(json_data, station_meta) is None
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_engines_render_alike(seed, monkeypatch):
+    # Templates and the font are looked up relative to the repository root
+    monkeypatch.chdir(ROOT)
+    json_data, station_meta = daily_data(60, 0.05, 1, seed=seed)
+    assert compare_day(json_data, station_meta, render=True) is None
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+# HttpClient.abort must interrupt a request that is blocked on a slow host,
+# so the losing observation source never holds the winner up until its timeout.
+
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app
+
+
+@pytest.fixture
+def stalled_server():
+    """A server that answers nothing, or only headers and a few body bytes, then stalls."""
+    listener = socket.create_server(("127.0.0.1", 0))
+    release = threading.Event()
+    stage = {}
+
+    def serve():
+        connection, _ = listener.accept()
+        connection.recv(65536)
+        if stage.get("send_headers"):
+            connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 1000\r\n\r\n" + b"x" * 10)
+        release.wait(30)
+        connection.close()
+
+    def start(send_headers=False):
+        stage["send_headers"] = send_headers
+        threading.Thread(target=serve, daemon=True).start()
+        return f"http://127.0.0.1:{listener.getsockname()[1]}/"
+
+    yield start
+    release.set()
+    listener.close()
+
+
+def client():
+    return app.HttpClient(policies={}, default_policy=app.HostPolicy(100.0, 10, 1, (5, 30)), retries=0)
+
+
+def run_until_aborted(http, fetch):
+    cancel = threading.Event()
+    outcome = {}
+
+    def run():
+        try:
+            fetch(cancel)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    time.sleep(0.3)
+    start = time.perf_counter()
+    http.abort(cancel)
+    thread.join(5)
+    return outcome.get("error"), time.perf_counter() - start, thread.is_alive()
+
+
+def test_abort_interrupts_a_request_waiting_for_headers(stalled_server):
+    http, url = client(), stalled_server()
+    error, seconds, alive = run_until_aborted(http, lambda cancel: http.get(url, cancel=cancel))
+    assert not alive and seconds < 2
+    assert isinstance(error, app.FetchCancelled)
+
+
+def test_abort_interrupts_a_stalled_streamed_body(stalled_server):
+    http, url = client(), stalled_server(send_headers=True)
+
+    def fetch(cancel):
+        with http.get(url, stream=True, cancel=cancel) as response:
+            for _ in app._cancellable(response.iter_content(chunk_size=100), cancel):
+                pass
+
+    error, seconds, alive = run_until_aborted(http, fetch)
+    assert not alive and seconds < 2
+    assert isinstance(error, app.FetchCancelled)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# ObservationStore.merge must keep the daily table equal to a full
+# re-aggregation of every hourly reading it has seen.
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app
+
+
+def obs(temp, hum=50.0, wind=10.0, prec=0.0):
+    return {"temperatura": temp, "humidade": hum, "intensidadeVentoKM": wind, "precAcumulada": prec}
+
+
+def feed(hours, stations, temp=lambda hour, station: 10.0):
+    return [(f"2026-02-14T{h:02d}:00", station, obs(temp(h, station))) for h in hours for station in stations]
+
+
+def test_late_station_for_an_hour_already_seen(tmp_path):
+    with app.ObservationStore(tmp_path / "obs.sqlite", tz_name="UTC") as store:
+        store.merge(feed(range(0, 11), ["A", "B"]))
+        # C only shows up on the next run, for an hour that is already stored
+        merged = store.merge(feed(range(0, 11), ["A", "B"]) + [("2026-02-14T08:00", "C", obs(99.0))])
+        day = store.daily_aggregates("2026-02-14")["2026-02-14"]
+    assert merged == 1
+    assert day["C"]["temp_max"] == 99.0
+
+
+def test_revised_reading_in_an_older_hour(tmp_path):
+    with app.ObservationStore(tmp_path / "obs.sqlite", tz_name="UTC") as store:
+        store.merge(feed(range(0, 11), ["A"], temp=lambda h, s: 30.0 if h == 3 else 10.0))
+        assert store.daily_aggregates("2026-02-14")["2026-02-14"]["A"]["temp_max"] == 30.0
+        # IPMA corrects 03:00 downwards after a later hour has landed
+        merged = store.merge(feed(range(0, 12), ["A"]))
+        day = store.daily_aggregates("2026-02-14")["2026-02-14"]
+    assert merged == 2  # the revision and the new 11:00 row
+    assert day["A"]["temp_max"] == 10.0
+
+
+def test_unchanged_feed_writes_nothing(tmp_path):
+    with app.ObservationStore(tmp_path / "obs.sqlite", tz_name="UTC") as store:
+        store.merge(feed(range(0, 24), ["A", "B"]))
+        assert store.merge(feed(range(0, 24), ["A", "B"])) == 0
+
+
+def test_records_are_streamed_into_the_store(tmp_path):
+    with app.ObservationStore(tmp_path / "obs.sqlite", tz_name="UTC") as store:
+        consumed = []
+
+        def records():
+            for record in feed(range(0, 24), ["A", "B"]):
+                consumed.append(record)
+                yield record
+
+        assert store.merge(records()) == 48 and len(consumed) == 48
+        assert store.merge(iter(())) == 0
+        assert store.daily_aggregates("2026-02-14")["2026-02-14"].keys() == {"A", "B"}
+
+
+def test_timezone_change_rebuilds_dates_across_dst(tmp_path):
+    path = tmp_path / "obs.sqlite"
+    records = [
+        (f"{day}T{h:02d}:00", "A", obs(float(h)))
+        for day in ("2026-03-28", "2026-03-29", "2026-03-30", "2026-10-24", "2026-10-25", "2026-10-26")
+        for h in range(24)
+    ]
+    with app.ObservationStore(path, tz_name="UTC") as store:
+        store.merge(records)
+        assert len(store.hours("2026-03-29")) == 24
+
+    with app.ObservationStore(path, tz_name="Europe/Lisbon") as store:
+        # Summer time starts on 29 March and ends on 25 October
+        assert store.hours("2026-03-29") == app.report_day_hours("2026-03-29", "Europe/Lisbon")
+        assert len(store.hours("2026-03-29")) == 23
+        assert len(store.hours("2026-10-25")) == 25
+        # 23:00 UTC on the 24th is already the 25th in Lisbon (UTC+1)
+        assert store.daily_aggregates("2026-10-25")["2026-10-25"]["A"]["temp_max"] == 23.0
+        assert store.daily_aggregates("2026-10-24")["2026-10-24"]["A"]["temp_max"] == 22.0
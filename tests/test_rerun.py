@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+# A workflow re-run for a day that was already drawn must leave the working
+# tree clean, so git-auto-commit has nothing to commit.
+
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import app
+
+
+def test_run_outputs_are_git_ignored():
+    for name in (app.RUN_REPORT_FILE, app.REPORT_MANIFEST_FILE, app.ROLLING_SUMMARY_FILE):
+        assert subprocess.run(["git", "check-ignore", "-q", name], cwd=ROOT).returncode == 0, name
+
+
+def test_unchanged_render_leaves_files_untouched(tmp_path, monkeypatch):
+    monkeypatch.chdir(ROOT)
+    rankings = defaultdict(list)
+    outputs = app.render_reports(rankings, {}, "2026-10-17", workers=1, output_dir=tmp_path,
+                                 skip_unchanged=True, derivatives=())
+    written = {path: (Path(path).read_bytes(), Path(path).stat().st_mtime_ns)
+               for path in outputs + [str(tmp_path / app.REPORT_MANIFEST_FILE)]}
+
+    app.render_reports(rankings, {}, "2026-10-17", workers=1, output_dir=tmp_path,
+                       skip_unchanged=True, derivatives=())
+
+    assert {path: (Path(path).read_bytes(), Path(path).stat().st_mtime_ns) for path in written} == written
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# RollingExtremes is only ever extended one day at a time; every window must
+# still equal a brute-force recompute over the full history.
+
+import math
+import random
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app
+
+
+def history(days=69, start=date(2025, 11, 10), seed=7):
+    """Seeded daily aggregates across a month and a year change, with gaps,
+    late-joining stations, -99.0 readings and missing columns."""
+    rng = random.Random(seed)
+    stations = [str(1200000 + i) for i in range(12)]
+    for offset in range(days):
+        if rng.random() < 0.1:
+            continue  # no report that day
+        day = start + timedelta(days=offset)
+        active = stations[:8] if offset < 20 else stations
+        yield f"{day:%Y-%m-%d}", {
+            station_id: {column: (-99.0 if rng.random() < 0.1 else round(rng.uniform(-5, 40), 1))
+                         for column in app.ROLLING_COLUMNS if rng.random() > 0.05}
+            for station_id in active if rng.random() > 0.1
+        }
+
+
+def brute_force(days, station_ids, start, end):
+    """(stat, station, column) max/min/sum/count over every stored day in [start, end]."""
+    stats = np.full((len(app.ROLLING_STATS), len(station_ids), len(app.ROLLING_COLUMNS)), np.nan)
+    for s, station_id in enumerate(station_ids):
+        for c, column in enumerate(app.ROLLING_COLUMNS):
+            values = [stations[station_id][column] for report_date, stations in days.items()
+                      if start <= date.fromisoformat(report_date) <= end
+                      and station_id in stations and stations[station_id].get(column, -99.0) != -99.0]
+            if values:
+                stats[:, s, c] = max(values), min(values), sum(values), len(values)
+            else:
+                stats[3, s, c] = 0
+    return stats
+
+
+def test_windows_match_a_brute_force_recompute(tmp_path):
+    state, seen = app.RollingExtremes(), {}
+    for i, (report_date, stations) in enumerate(history()):
+        assert state.update(report_date, stations)
+        seen[report_date] = stations
+        if i % 10 == 5:
+            # The state travels between runs as an .npz
+            state.save(tmp_path / "rolling.npz")
+            state = app.RollingExtremes.load(tmp_path / "rolling.npz")
+        last = date.fromisoformat(report_date)
+        for window in app.ROLLING_WINDOWS:
+            assert state.window_start(window) == {"7d": last - timedelta(days=6), "30d": last - timedelta(days=29),
+                                                  "mtd": last.replace(day=1), "ytd": last.replace(month=1, day=1)}[window]
+            expected = brute_force(seen, state.station_ids, state.window_start(window), last)
+            np.testing.assert_allclose(state.window(window), expected, equal_nan=True, err_msg=f"{window} on {report_date}")
+
+
+def test_days_not_newer_than_the_last_are_ignored():
+    state = app.RollingExtremes()
+    days = dict(history(days=5))
+    for report_date, stations in days.items():
+        state.update(report_date, stations)
+    before = state.window("7d")
+    assert not any(state.update(report_date, stations) for report_date, stations in days.items())
+    np.testing.assert_array_equal(state.window("7d"), before)
+
+
+def test_window_aggregates_use_each_column_statistic():
+    state = app.RollingExtremes()
+    state.update("2026-03-01", {"A": {"temp_max": 20.0, "temp_min": 5.0, "prec_quant": 1.2}})
+    state.update("2026-03-02", {"A": {"temp_max": 25.0, "temp_min": 3.0, "prec_quant": 2.1}})
+    window = state.window_aggregates("7d")["A"]
+    assert (window["temp_max"], window["temp_min"], window["prec_quant"]) == (25.0, 3.0, 3.3)
+    assert window["hum_max"] == -99.0 and not math.isnan(window["hum_max"])
+
+
+def test_rankings_leave_the_run_counters_alone(monkeypatch, caplog):
+    monkeypatch.setattr(app, "METRICS", app.RunMetrics())
+    state = app.RollingExtremes()
+    state.update("2026-03-01", {"1": {"temp_max": 20.0}, "2": {"temp_max": 25.0}})
+    station_meta = {"1": {"location": "Lisboa", "place": "Portugal", "coordinates": {"lat": 38.72, "lng": -9.15}}}
+    for engine_name in app.ENGINES:
+        rows = app._ranked_records(state.rankings("7d", station_meta, engine_name)["Portugal", "temp_max"])
+        assert [str(row["stationId"]) for row in rows] == ["1"]
+    assert app.METRICS.counters == {}
+    assert "Could not get info" not in caplog.text
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+# RunMetrics.to_prometheus must emit valid text-format label values.
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app
+
+
+def test_label_values_are_escaped():
+    metrics = app.RunMetrics()
+    metrics.count("http_errors", host='a\\b "c"\nd')
+    line = next(line for line in metrics.to_prometheus().splitlines() if line.startswith("daily_weather_report_http_errors"))
+    assert line == 'daily_weather_report_http_errors_total{host="a\\\\b \\"c\\"\\nd"} 1'
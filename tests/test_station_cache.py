@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+# A warm run must not ask api.fogos.pt about any station: ids that were
+# resolved are cached, and so are ids whose lookup failed, until the TTL.
+
+import json
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app
+
+LISBOA = {"place": "Portugal", "location": "Lisboa", "coordinates": [38.72, -9.15]}
+
+
+@pytest.fixture
+def lookups(tmp_path, monkeypatch):
+    """Ids sent to getStationsByIds; only "1" is known to the fake API."""
+    monkeypatch.setattr(app, "STATION_CACHE_FILE", tmp_path / "stations.json")
+    asked = []
+
+    def lookup(ids):
+        asked.extend(ids)
+        return [app.StationLookup(i, LISBOA, None) if i == "1" else app.StationLookup(i, None, ValueError("unknown"))
+                for i in ids]
+
+    monkeypatch.setattr(app, "getStationsByIds", lookup)
+    return asked
+
+
+def test_failed_lookups_are_not_repeated(lookups):
+    stations = app.resolve_station_metadata(["1", "2"], {})
+    assert lookups == ["1", "2"] and stations == {"1": LISBOA}
+
+    del lookups[:]
+    _, cached, _ = app._read_station_cache()
+    assert app.resolve_station_metadata(["1", "2"], cached) == {"1": LISBOA}
+    assert lookups == []
+
+
+def test_failed_lookups_are_retried_after_the_ttl(lookups):
+    app.resolve_station_metadata(["2"], {})
+    cache = json.loads(app.STATION_CACHE_FILE.read_text(encoding="utf-8"))
+    expired = datetime.now(ZoneInfo("UTC")) - app.STATION_CACHE_TTL - timedelta(minutes=1)
+    cache["misses"]["2"] = expired.isoformat()
+    app.STATION_CACHE_FILE.write_text(json.dumps(cache), encoding="utf-8")
+
+    del lookups[:]
+    app.resolve_station_metadata(["2"], {})
+    assert lookups == ["2"]
+
+
+def test_cache_written_before_misses_were_kept_still_loads(lookups):
+    app.STATION_CACHE_FILE.write_text(json.dumps({"fetched_at": datetime.now(ZoneInfo("UTC")).isoformat(),
+                                                  "stations": {"1": LISBOA}}), encoding="utf-8")
+    _, stations, misses = app._read_station_cache()
+    assert stations == {"1": LISBOA} and misses == {}
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+# Stations are placed in a territory from their coordinates alone, so the
+# built-in outlines must keep Portuguese stations in and Spanish towns out.
+
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import app
+
+NO_FILE = "does-not-exist.geojson"
+
+MAINLAND = {
+    "Lisboa": (38.72, -9.15), "Porto": (41.15, -8.61), "Faro": (37.02, -7.93), "Sagres": (37.01, -8.94),
+    "Berlenga": (39.41, -9.51), "Melgaço": (42.11, -8.26), "Montalegre": (41.82, -7.79), "Chaves": (41.74, -7.47),
+    "Bragança": (41.81, -6.76), "Miranda do Douro": (41.50, -6.27), "Vilar Formoso": (40.61, -6.83),
+    "Marvão": (39.39, -7.38), "Campo Maior": (39.02, -7.07), "Elvas": (38.88, -7.16), "Barrancos": (38.13, -6.98),
+    "Vila Real de Santo António": (37.19, -7.42),
+}
+SPAIN = {
+    "Vigo": (42.24, -8.72), "Ourense": (42.34, -7.86), "Verín": (41.93, -7.44), "Valencia de Alcántara": (39.41, -7.24),
+    "Badajoz": (38.88, -6.97), "Huelva": (37.26, -6.95), "Ayamonte": (37.21, -7.40),
+}
+
+
+def outline_of(territory):
+    return next(region for region in app.BUILTIN_REGIONS if region.territory == territory and region.rings)
+
+
+def edges_of(region):
+    ring = np.asarray(region.rings[0], dtype=float)
+    return np.hstack([ring[:-1], ring[1:]])
+
+
+def test_inside_rings_even_odd():
+    # A 4x4 square with a 2x2 hole in the middle
+    outer = [(0, 0), (4, 0), (4, 4), (0, 4), (0, 0)]
+    hole = [(1, 1), (3, 1), (3, 3), (1, 3), (1, 1)]
+    edges = np.vstack([np.hstack([np.asarray(r[:-1], float), np.asarray(r[1:], float)]) for r in (outer, hole)])
+    x = np.array([0.5, 2.0, 3.5, 5.0, 2.0])
+    y = np.array([0.5, 2.0, 3.5, 2.0, -1.0])
+    assert app._inside_rings(x, y, edges).tolist() == [True, False, True, False, False]
+
+
+def test_mainland_stations_and_spanish_towns():
+    located = app.locate_coordinates(list(MAINLAND.values()) + list(SPAIN.values()), regions_file=NO_FILE)
+    names = list(MAINLAND) + list(SPAIN)
+    territories = {name: region.territory if region else None for name, region in zip(names, located)}
+    assert territories == {**dict.fromkeys(MAINLAND, "Portugal"), **dict.fromkeys(SPAIN)}
+
+
+@pytest.mark.parametrize("territory", ["Açores", "Madeira"])
+def test_every_island_box_lies_inside_its_archipelago_outline(territory):
+    edges = edges_of(outline_of(territory))
+    for island in app.BUILTIN_REGIONS:
+        if island.territory != territory or island.rings:
+            continue
+        min_lat, min_lon, max_lat, max_lon = island.bbox
+        x = np.array([min_lon, min_lon, max_lon, max_lon])
+        y = np.array([min_lat, max_lat, min_lat, max_lat])
+        assert app._inside_rings(x, y, edges).all(), island.name
+
+
+def test_islands_win_over_their_archipelago_and_open_ocean_is_unknown():
+    located = app.locate_coordinates([(37.74, -25.67), (38.53, -28.63), (32.65, -16.91), (35.0, -20.0), None],
+                                     regions_file=NO_FILE)
+    assert [region and region.name for region in located] == ["São Miguel", "Faial", "Madeira", None, None]
+
+
+def test_regions_file_is_checked_first(tmp_path):
+    square = [[-9.3, 38.6], [-9.0, 38.6], [-9.0, 38.9], [-9.3, 38.9], [-9.3, 38.6]]
+    path = tmp_path / "regions.geojson"
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": [
+        {"properties": {"name": "Lisboa", "territory": "Portugal"}, "geometry": {"type": "Polygon", "coordinates": [square]}},
+    ]}), encoding="utf-8")
+    located = app.locate_coordinates([(38.72, -9.15), (41.15, -8.61)], regions_file=str(path))
+    assert [region.name for region in located] == ["Lisboa", "Portugal continental"]